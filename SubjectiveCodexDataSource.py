@@ -2,10 +2,2419 @@ import os
 import subprocess
 import json
 import shutil
-from typing import Any, Optional
+import time
+import queue
+import threading
+import collections
+import collections.abc
+import asyncio
+import itertools
+import hashlib
+import sqlite3
+import zlib
+import math
+import heapq
+import re
+import mmap
+import tempfile
+import weakref
+import types
+import http.server
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
 from subjective_abstract_data_source_package import SubjectiveOnDemandDataSource
 from brainboost_data_source_logger_package.BBLogger import BBLogger
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _json_loads_for(backend: str) -> Callable[[bytes], Any]:
+    """Resolve the ``json_backend`` param to a bytes-accepting loads function."""
+    if backend == "orjson" and orjson is None:
+        BBLogger.log("orjson is not installed, falling back to the json module")
+    if backend in ("auto", "orjson") and orjson is not None:
+        return orjson.loads
+    return json.loads
+
+
+class _NDJSONParser:
+    """
+    Incremental newline-delimited JSON decoder over byte chunks.
+
+    Only the trailing partial line of the last chunk is buffered, so memory
+    stays proportional to the largest single event rather than to the run.
+    Blank and non-JSON lines (status output) are skipped.
+
+    ``feed`` and ``close`` yield ``(event, line)`` pairs. When a ``defer``
+    predicate accepts a line's sniffed type, the line is yielded undecoded
+    with ``event`` set to None so it can be stored raw and decoded later.
+    """
+
+    __slots__ = ("_loads", "_skip", "_defer", "_pending", "bytes_parsed", "lines_skipped")
+
+    # The event type is looked for in this many leading bytes of a line
+    SNIFF_BYTES = 256
+    _TYPE_PATTERN = re.compile(rb'"type"\s*:\s*"([^"\\]*)"')
+
+    def __init__(self, loads: Callable[[bytes], Any] = json.loads,
+                 skip: Optional[Callable[[str], bool]] = None,
+                 defer: Optional[Callable[[str], bool]] = None):
+        self._loads = loads
+        self._skip = skip
+        self._defer = defer
+        self._pending = bytearray()
+        self.bytes_parsed = 0
+        self.lines_skipped = 0
+
+    def _decode(self, line) -> Optional[Tuple[Optional[dict], bytes]]:
+        line = line.strip()
+        if not line:
+            return None
+        if (self._skip is not None or self._defer is not None) and line[:1] == b"{":
+            # Sniff the type so lines that are discarded or stored raw are never decoded
+            match = self._TYPE_PATTERN.search(line, 0, self.SNIFF_BYTES)
+            if match:
+                event_type = match.group(1).decode("utf-8", errors="replace")
+                if self._skip is not None and self._skip(event_type):
+                    self.lines_skipped += 1
+                    return None
+                if self._defer is not None and self._defer(event_type):
+                    return None, bytes(line)
+        try:
+            event = self._loads(line)
+        except ValueError:
+            # Non-JSON line, might be status output
+            return None
+        return (event, line) if isinstance(event, dict) else None
+
+    def feed(self, chunk: bytes) -> Iterator[Tuple[Optional[dict], bytes]]:
+        """Yield every event completed by ``chunk``."""
+        self.bytes_parsed += len(chunk)
+        start = 0
+        newline = chunk.find(b"\n")
+        if newline != -1 and self._pending:
+            # Finish the line that straddled the previous chunk boundary
+            self._pending += chunk[:newline]
+            decoded = self._decode(bytes(self._pending))
+            self._pending.clear()
+            if decoded is not None:
+                yield decoded
+            start = newline + 1
+            newline = chunk.find(b"\n", start)
+
+        while newline != -1:
+            decoded = self._decode(chunk[start:newline])
+            if decoded is not None:
+                yield decoded
+            start = newline + 1
+            newline = chunk.find(b"\n", start)
+
+        if start < len(chunk):
+            self._pending += chunk[start:]
+
+    def close(self) -> Iterator[Tuple[Optional[dict], bytes]]:
+        """Yield the final event if the stream did not end with a newline."""
+        if self._pending:
+            decoded = self._decode(bytes(self._pending))
+            self._pending.clear()
+            if decoded is not None:
+                yield decoded
+
+
+class _MappedSpill:
+    """
+    Read-only, mmap-backed view of a spilled temp file.
+
+    Supports ``len``, slicing and ``bytes()``. The mapping and the file are
+    released when the last reference goes away (or on interpreter exit).
+    """
+
+    __slots__ = ("_mmap", "_finalizer", "__weakref__")
+
+    def __init__(self, file):
+        file.flush()
+        self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Anonymous temp files are deleted by the OS once closed
+        self._finalizer = weakref.finalize(self, _MappedSpill._release, self._mmap, file)
+
+    @staticmethod
+    def _release(mapping, file) -> None:
+        mapping.close()
+        file.close()
+
+    def __len__(self) -> int:
+        return len(self._mmap)
+
+    def __getitem__(self, index):
+        return self._mmap[index]
+
+    def __bytes__(self) -> bytes:
+        return self._mmap[:]
+
+    def decode(self, encoding: str = "utf-8", errors: str = "strict") -> str:
+        return self._mmap[:].decode(encoding, errors)
+
+    def close(self) -> None:
+        self._finalizer()
+
+    def __repr__(self) -> str:
+        return f"<_MappedSpill: {len(self)} bytes>"
+
+
+class _SpillBuffer:
+    """Append-only byte store that moves to an anonymous temp file on demand."""
+
+    __slots__ = ("_memory", "_file", "_size")
+
+    def __init__(self):
+        self._memory = bytearray()
+        self._file = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, data: bytes) -> None:
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._memory += data
+        self._size += len(data)
+
+    def spill(self, directory: Optional[str] = None) -> None:
+        """Move everything written so far to a temp file and keep appending there."""
+        if self._file is not None:
+            return
+        self._file = tempfile.TemporaryFile(prefix="codex-spill-", dir=directory)
+        self._file.write(self._memory)
+        self._memory = bytearray()
+
+    def freeze(self):
+        """Return the contents as bytes, or as an mmap-backed view once spilled."""
+        if self._file is not None:
+            if not self._size:
+                # Nothing was retained after the spill, and an empty file cannot be mapped
+                self._file.close()
+                self._file = None
+                return b""
+            return _MappedSpill(self._file)
+        return bytes(self._memory)
+
+
+class _EventBuffer:
+    """
+    Append-only store of raw event lines.
+
+    Lines live back to back in one buffer (each NDJSON line keeps its
+    newline) with an offset index, instead of as one dict tree per event.
+    The buffer can spill to a temp file when a run's output gets too large.
+    """
+
+    __slots__ = ("_data", "_offsets")
+
+    def __init__(self):
+        self._data = _SpillBuffer()
+        self._offsets = array("Q", [0])
+
+    @property
+    def spilled(self) -> bool:
+        return self._data.spilled
+
+    def spill(self, directory: Optional[str] = None) -> None:
+        self._data.spill(directory)
+
+    def append_line(self, line: bytes) -> None:
+        self._data.write(line)
+        self._data.write(b"\n")
+        self._offsets.append(len(self._data))
+
+    def append_event(self, event: dict) -> None:
+        self.append_line(json.dumps(event, separators=(",", ":")).encode("utf-8"))
+
+    @classmethod
+    def from_events(cls, events: Iterable[dict]) -> "_EventBuffer":
+        buffer = cls()
+        for event in events:
+            buffer.append_event(event)
+        return buffer
+
+    def freeze(self) -> Tuple[Any, array]:
+        """Return (buffer, offsets); the buffer is a _MappedSpill once spilled."""
+        return self._data.freeze(), self._offsets
+
+
+class CodexLazyEvents(collections.abc.Sequence):
+    """Read-only sequence of events decoded from a shared buffer on access."""
+
+    __slots__ = ("_buffer", "_offsets", "_loads")
+
+    def __init__(self, buffer, offsets: array, loads: Callable[[bytes], Any] = json.loads):
+        self._buffer = buffer
+        self._offsets = offsets
+        self._loads = loads
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("event index out of range")
+        return self._loads(self._buffer[self._offsets[index]:self._offsets[index + 1]])
+
+    def __repr__(self) -> str:
+        return f"<CodexLazyEvents: {len(self)} events>"
+
+
+def _json_default(value: Any) -> Any:
+    """json.dumps fallback that materializes lazy events and spilled output."""
+    if isinstance(value, CodexLazyEvents):
+        return list(value)
+    if isinstance(value, _MappedSpill):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+class CodexResult(collections.abc.Mapping):
+    """
+    Compact response object that behaves like the usual response dict.
+
+    Scalar fields are kept in a small dict; events are stored as one
+    contiguous bytes buffer plus an offset index and only decoded when
+    accessed. ``result["events"]`` returns a lazy sequence; ``to_dict()``
+    materializes a plain dict.
+    """
+
+    __slots__ = ("_fields", "_buffer", "_offsets", "_loads", "__weakref__")
+
+    def __init__(self, fields: dict, buffer=b"", offsets: Optional[array] = None,
+                 loads: Callable[[bytes], Any] = json.loads):
+        self._fields = fields
+        self._buffer = buffer
+        self._offsets = offsets if offsets is not None else array("Q", [0])
+        self._loads = loads
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "events":
+            return CodexLazyEvents(self._buffer, self._offsets, self._loads)
+        return self._fields[key]
+
+    def __iter__(self):
+        yield from self._fields
+        yield "events"
+
+    def __len__(self) -> int:
+        return len(self._fields) + 1
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate retained size: the event buffer, its index and the response text."""
+        text = self._fields.get("response") or ""
+        return len(self._buffer) + self._offsets.itemsize * len(self._offsets) + len(text)
+
+    def with_fields(self, **fields) -> "CodexResult":
+        """Copy sharing the same event buffer, with extra or replaced fields."""
+        return CodexResult(dict(self._fields, **fields), self._buffer, self._offsets, self._loads)
+
+    def to_dict(self) -> dict:
+        result = dict(self._fields)
+        result["events"] = list(self["events"])
+        return result
+
+    def __repr__(self) -> str:
+        return f"CodexResult({self._fields!r}, events={len(self._offsets) - 1})"
+
+
+class _PhaseTimer:
+    """Monotonic timestamps for the phases of one Codex request."""
+
+    __slots__ = ("start", "marks")
+
+    # (reported phase, from mark, to mark)
+    PHASES = (
+        ("auth", "start", "authenticated"),
+        ("build", "authenticated", "built"),
+        ("spawn", "built", "spawned"),
+        ("first_byte", "spawned", "first_byte"),
+        ("first_token", "spawned", "first_token"),
+        ("run", "spawned", "exited"),
+        ("parse", "exited", "parsed"),
+        ("total", "start", "parsed"),
+    )
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.marks = {"start": self.start}
+
+    def mark(self, name: str) -> None:
+        """Record when ``name`` happened; only the first occurrence counts."""
+        if name not in self.marks:
+            self.marks[name] = time.monotonic()
+
+    def durations(self) -> dict:
+        """Seconds spent in each phase whose start and end were both reached."""
+        durations = {}
+        for phase, begin, end in self.PHASES:
+            if begin in self.marks and end in self.marks:
+                durations[phase] = self.marks[end] - self.marks[begin]
+        return durations
+
+
+class _Histogram:
+    """Cumulative-bucket histogram, Prometheus style."""
+
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": dict(zip(self.buckets, self.counts)),
+                "sum": self.sum,
+                "count": self.count
+            }
+
+
+class _MetricsRegistry:
+    """Process-wide registry of labelled metrics for the Codex data source."""
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+    HELP = {
+        "codex_requests_total": "Codex requests by outcome (success or error_type) and model.",
+        "codex_phase_seconds": "Seconds spent in each phase of a Codex request.",
+        "codex_in_flight": "Codex requests currently executing.",
+        "codex_queue_depth": "Requests waiting in the priority scheduler.",
+        "codex_cache_lookups_total": "Response cache lookups by result.",
+        "codex_bytes_parsed_total": "Bytes of codex NDJSON output parsed.",
+        "codex_tokens_total": "Tokens reported by codex, by kind and model.",
+        "codex_rate_limited_total": "Runs refused for rate limits, by API key id.",
+        "codex_api_key_in_flight": "Requests in flight per API key id.",
+        "codex_concurrency_limit": "Current adaptive concurrency limit.",
+        "codex_overload_signals_total": "Runs classified as rate limited or overloaded.",
+        "codex_child_cpu_seconds_total": "CPU seconds used by reaped child processes.",
+        "codex_child_max_rss_bytes": "Peak resident set size of the largest reaped child process.",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._collectors = []
+        self._server = None
+
+    @staticmethod
+    def _labels_key(labels: Optional[dict]) -> tuple:
+        return tuple(sorted((labels or {}).items()))
+
+    def histogram(self, name: str, labels: Optional[dict] = None,
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> _Histogram:
+        key = (name, self._labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(buckets)
+            return histogram
+
+    def observe(self, name: str, value: float, labels: Optional[dict] = None) -> None:
+        self.histogram(name, labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1, labels: Optional[dict] = None) -> None:
+        """Add ``amount`` to a counter."""
+        key = (name, self._labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_gauge(self, name: str, amount: float, labels: Optional[dict] = None) -> None:
+        """Move a gauge up or down by ``amount``."""
+        key = (name, self._labels_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def add_collector(self, callback: Callable[[], Iterable[tuple]]) -> None:
+        """
+        Register a callback sampled at render time.
+
+        The callback yields (name, labels, value) gauge samples. Bound methods
+        are held weakly so registering does not keep a data source alive.
+        """
+        ref = weakref.WeakMethod(callback) if hasattr(callback, "__self__") else (lambda: callback)
+        with self._lock:
+            self._collectors.append(ref)
+
+    def histogram_snapshots(self) -> list:
+        with self._lock:
+            items = list(self._histograms.items())
+        return [
+            {"name": name, "labels": dict(labels), **histogram.snapshot()}
+            for (name, labels), histogram in items
+        ]
+
+    def _collect(self) -> dict:
+        """Sum collector samples and process-level gauges by (name, labels)."""
+        with self._lock:
+            gauges = dict(self._gauges)
+            refs = list(self._collectors)
+            self._collectors = [ref for ref in refs if ref() is not None]
+        for ref in refs:
+            callback = ref()
+            if callback is None:
+                continue
+            for name, labels, value in callback():
+                key = (name, self._labels_key(labels))
+                gauges[key] = gauges.get(key, 0) + value
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            gauges[("codex_child_cpu_seconds_total", ())] = usage.ru_utime + usage.ru_stime
+            # ru_maxrss is in kilobytes on Linux
+            gauges[("codex_child_max_rss_bytes", ())] = usage.ru_maxrss * 1024
+        return gauges
+
+    @staticmethod
+    def _format_labels(labels, extra: Optional[tuple] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = list(self._histograms.items())
+        gauges = self._collect()
+
+        families = collections.defaultdict(list)
+        for (name, labels), value in counters.items():
+            families[(name, "counter")].append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), value in gauges.items():
+            kind = "counter" if name.endswith("_total") else "gauge"
+            families[(name, kind)].append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            snapshot = histogram.snapshot()
+            lines = families[(name, "histogram")]
+            for bound, count in snapshot["buckets"].items():
+                lines.append(f"{name}_bucket{self._format_labels(labels, ('le', bound))} {count}")
+            lines.append(f"{name}_bucket{self._format_labels(labels, ('le', '+Inf'))} {snapshot['count']}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {snapshot['sum']}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {snapshot['count']}")
+
+        out = []
+        for (name, kind), lines in sorted(families.items()):
+            if name in self.HELP:
+                out.append(f"# HELP {name} {self.HELP[name]}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> int:
+        """
+        Serve ``render()`` over HTTP on a daemon thread, once per process.
+
+        Returns:
+            The port actually bound, which differs from ``port`` when it is 0
+        """
+        with self._lock:
+            if self._server is not None:
+                return self._server.server_address[1]
+            registry = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name="codex-metrics", daemon=True).start()
+            return self._server.server_address[1]
+
+
+# Shared by every data source instance in the process
+_METRICS = _MetricsRegistry()
+
+
+class _CodexWorkerError(RuntimeError):
+    """Raised when a pooled Codex worker dies or stops answering."""
+
+
+class _CodexWorker:
+    """
+    A long-lived ``codex mcp-server`` process driven over stdio JSON-RPC.
+
+    Each prompt is sent as a ``tools/call`` request for the ``codex`` tool;
+    ``codex/event`` notifications emitted while the call runs are collected
+    as the run's events.
+    """
+
+    PROTOCOL_VERSION = "2025-03-26"
+
+    def __init__(self, codex_path: str, env: dict, cwd: Optional[str], startup_timeout: float):
+        self.process = subprocess.Popen(
+            [codex_path, "mcp-server"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            bufsize=1,
+            env=env,
+            cwd=cwd
+        )
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.jobs = 0
+        self._next_id = 0
+        self._lines = queue.Queue()
+        self._stderr = collections.deque(maxlen=50)
+
+        threading.Thread(target=self._pump, args=(self.process.stdout, self._lines.put), daemon=True).start()
+        threading.Thread(target=self._pump, args=(self.process.stderr, self._stderr.append), daemon=True).start()
+
+        try:
+            self._request("initialize", {
+                "protocolVersion": self.PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {"name": "subjective_codex_datasource", "version": "0.1.0"}
+            }, timeout=startup_timeout)
+            self._send({"jsonrpc": "2.0", "method": "notifications/initialized"})
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _pump(stream, sink: Callable) -> None:
+        """Copy lines from a pipe into ``sink`` until EOF, then push ``None``."""
+        try:
+            for line in stream:
+                sink(line)
+        except (OSError, ValueError):
+            pass
+        sink(None)
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stderr_tail(self) -> str:
+        return "".join(line for line in list(self._stderr) if line)
+
+    def _send(self, payload: dict) -> None:
+        try:
+            self.process.stdin.write(json.dumps(payload) + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise _CodexWorkerError(f"Codex worker pipe closed: {e}")
+
+    def _request(self, method: str, params: Optional[dict], timeout: float,
+                 on_notification: Optional[Callable] = None) -> dict:
+        """Send a JSON-RPC request and block until its response arrives."""
+        self._next_id += 1
+        request_id = self._next_id
+        payload = {"jsonrpc": "2.0", "id": request_id, "method": method}
+        if params is not None:
+            payload["params"] = params
+        self._send(payload)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(method, timeout)
+            try:
+                line = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                raise subprocess.TimeoutExpired(method, timeout)
+
+            if line is None:
+                raise _CodexWorkerError(f"Codex worker exited: {self.stderr_tail() or 'no output'}")
+            try:
+                frame = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+            if frame.get("id") == request_id and "method" not in frame:
+                if "error" in frame:
+                    raise _CodexWorkerError(frame["error"].get("message", "Codex worker request failed"))
+                return frame.get("result") or {}
+
+            if "method" in frame and "id" in frame:
+                # Server-initiated request (e.g. an approval prompt); nobody can answer it here
+                self._send({
+                    "jsonrpc": "2.0",
+                    "id": frame["id"],
+                    "error": {"code": -32601, "message": "Not supported by subjective_codex_datasource"}
+                })
+            elif "method" in frame and on_notification:
+                on_notification(frame)
+
+    def ping(self, timeout: float = 5) -> bool:
+        """Cheap liveness probe used before handing an idle worker out."""
+        if not self.is_alive():
+            return False
+        try:
+            self._request("ping", None, timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    def run(self, arguments: dict, timeout: float, on_event: Optional[Callable] = None) -> dict:
+        """Run one prompt through the ``codex`` tool and collect its events."""
+        events = []
+
+        def on_notification(frame):
+            if frame.get("method") == "codex/event":
+                msg = (frame.get("params") or {}).get("msg")
+                if isinstance(msg, dict):
+                    events.append(msg)
+                    if on_event:
+                        on_event(msg)
+
+        self.jobs += 1
+        try:
+            result = self._request("tools/call", {"name": "codex", "arguments": arguments},
+                                   timeout=timeout, on_notification=on_notification)
+        finally:
+            self.last_used = time.monotonic()
+
+        text = "".join(
+            item.get("text", "")
+            for item in result.get("content", [])
+            if isinstance(item, dict) and item.get("type") == "text"
+        )
+        return {"events": events, "text": text, "is_error": bool(result.get("isError"))}
+
+    def close(self) -> None:
+        try:
+            if self.process.stdin:
+                self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def kill(self) -> None:
+        """Stop a worker left mid-request without giving it time to finish."""
+        self.process.kill()
+        try:
+            if self.process.stdin:
+                self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+
+class _CodexWorkerPool:
+    """
+    Fixed-size pool of warm Codex workers.
+
+    Workers are health-checked on checkout, recycled after ``max_jobs`` jobs
+    or ``max_age`` seconds, and replaced transparently when they crash.
+    """
+
+    def __init__(self, factory: Callable[[], _CodexWorker], size: int, max_jobs: int,
+                 max_age: float, health_interval: float):
+        self._factory = factory
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_age = max_age
+        self.health_interval = health_interval
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def prewarm(self) -> None:
+        """Spawn workers in the background until the pool is full."""
+        def warm():
+            # Hold a slot per new worker so concurrent checkouts cannot overfill the pool
+            spawned = []
+            for _ in range(self.size):
+                if not self._slots.acquire(blocking=False):
+                    break
+                try:
+                    spawned.append(self._factory())
+                except Exception as e:
+                    BBLogger.log(f"Failed to prewarm Codex worker: {e}")
+                    self._slots.release()
+                    break
+            for worker in spawned:
+                self.checkin(worker)
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def _expired(self, worker: _CodexWorker) -> bool:
+        if self.max_jobs and worker.jobs >= self.max_jobs:
+            return True
+        if self.max_age and time.monotonic() - worker.created_at >= self.max_age:
+            return True
+        return False
+
+    def _healthy(self, worker: _CodexWorker) -> bool:
+        if not worker.is_alive() or self._expired(worker):
+            return False
+        if self.health_interval and time.monotonic() - worker.last_used >= self.health_interval:
+            return worker.ping()
+        return True
+
+    def checkout(self, timeout: Optional[float] = None) -> _CodexWorker:
+        """Borrow a healthy worker, spawning a replacement if needed."""
+        if self._closed:
+            raise _CodexWorkerError("Codex worker pool is closed")
+        if not self._slots.acquire(timeout=timeout):
+            raise subprocess.TimeoutExpired("codex worker checkout", timeout)
+
+        try:
+            while True:
+                with self._lock:
+                    worker = self._idle.popleft() if self._idle else None
+                if worker is None:
+                    return self._factory()
+                if self._healthy(worker):
+                    return worker
+                BBLogger.log(f"Recycling Codex worker (pid {worker.process.pid}, {worker.jobs} jobs)")
+                worker.close()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def checkin(self, worker: _CodexWorker, healthy: bool = True) -> None:
+        """Return a worker to the pool, or retire it if it is no longer usable."""
+        try:
+            if not healthy:
+                # Possibly still busy with a timed-out request; a graceful close would wait on it
+                worker.kill()
+            elif self._closed or not worker.is_alive() or self._expired(worker):
+                worker.close()
+            else:
+                with self._lock:
+                    self._idle.append(worker)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            workers = list(self._idle)
+            self._idle.clear()
+        for worker in workers:
+            worker.close()
+
+
+class _ResponseCache:
+    """
+    Thread-safe in-memory LRU cache of Codex responses.
+
+    Bounded by entry count and by approximate payload bytes; entries also
+    expire ``ttl`` seconds after they were stored.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # key -> (expires_at, size, result)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def estimate_size(result: dict) -> int:
+        if isinstance(result, CodexResult):
+            return result.nbytes
+        return len(json.dumps(result, default=str))
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, result = entry
+            if self.ttl and time.monotonic() >= expires_at:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: str, result: dict, size: Optional[int] = None) -> None:
+        if size is None:
+            size = self.estimate_size(result)
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self._bytes += size
+
+            while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class _BloomFilter:
+    """Fixed-size Bloom filter over hex digest keys."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        # Standard sizing: m = -n ln(p) / ln(2)^2, k = m/n ln(2)
+        self._bit_count = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._hash_count = max(1, round(self._bit_count / self.capacity * math.log(2)))
+        self._bits = bytearray((self._bit_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Keys are already uniform digests; double hashing over two 64-bit slices
+        digest = bytes.fromhex(key) if len(key) >= 32 else hashlib.sha256(key.encode("utf-8")).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self._hash_count):
+            yield (first + i * second) % self._bit_count
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class _DiskResponseCache:
+    """
+    Persistent SQLite tier of the response cache.
+
+    Payloads are zlib-compressed JSON, the database runs in WAL mode, and the
+    total payload size is capped with least-recently-used eviction. A Bloom
+    filter of stored keys answers most misses without touching the disk.
+
+    Several processes or instances may share one file: the size cap is
+    checked against the table itself inside the writing transaction, and
+    the Bloom filter picks up rows other connections added whenever SQLite
+    reports the file changed.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, payload BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+
+        if self.ttl:
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        rows = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        self._rebuild_bloom(max(1024, rows * 2))
+
+    def _data_version(self) -> int:
+        # Changes whenever another connection commits to the file
+        return self._db.execute("PRAGMA data_version").fetchone()[0]
+
+    def _rebuild_bloom(self, capacity: int) -> None:
+        self._bloom = _BloomFilter(capacity)
+        self._bloom_rowid = 0
+        self._seen_version = self._data_version()
+        self._add_to_bloom("SELECT rowid, key FROM responses")
+
+    def _add_to_bloom(self, query: str, *args) -> None:
+        for rowid, key in self._db.execute(query, args).fetchall():
+            if self._bloom.count >= self._bloom.capacity:
+                self._rebuild_bloom(self._bloom.capacity * 2)
+                return
+            self._bloom.add(key)
+            self._bloom_rowid = max(self._bloom_rowid, rowid)
+
+    def _sync_bloom(self) -> None:
+        """Add keys other connections stored since the filter was last brought up to date."""
+        version = self._data_version()
+        if version != self._seen_version:
+            self._seen_version = version
+            # Replaced rows get a new rowid, so everything written elsewhere is past the last one seen
+            self._add_to_bloom("SELECT rowid, key FROM responses WHERE rowid > ?", self._bloom_rowid)
+
+    def _total_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            if key not in self._bloom:
+                self._sync_bloom()
+                if key not in self._bloom:
+                    self.misses += 1
+                    return None
+
+            row = self._db.execute(
+                "SELECT payload, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            payload, created_at = row
+            now = time.time()
+            if self.ttl and now - created_at >= self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+
+        return json.loads(zlib.decompress(payload))
+
+    def put(self, key: str, result: dict) -> None:
+        if isinstance(result, CodexResult):
+            result = result.to_dict()
+        payload = zlib.compress(json.dumps(result, default=_json_default).encode("utf-8"))
+        size = len(payload)
+        if self.max_bytes and size > self.max_bytes:
+            return
+
+        with self._lock:
+            now = time.time()
+            # One writer at a time across every connection, so the cap sees a consistent total
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, payload, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, payload, size, now, now)
+                )
+                if self.max_bytes:
+                    self._evict(self._total_bytes())
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            if key not in self._bloom:
+                if self._bloom.count >= self._bloom.capacity:
+                    self._rebuild_bloom(self._bloom.capacity * 2)
+                else:
+                    self._bloom.add(key)
+
+    def _evict(self, total: int) -> None:
+        """Delete least recently used rows until the size cap is met."""
+        if total <= self.max_bytes:
+            return
+        # Evicted keys stay in the Bloom filter; they only cost a false-positive lookup
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._rebuild_bloom(self._bloom.capacity)
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {
+                "path": self.path,
+                "entries": rows,
+                "bytes": total,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class _WorkspaceFingerprinter:
+    """
+    Cheap, memoized fingerprints of a directory's contents.
+
+    Git work trees are fingerprinted from ``git status`` of the whole
+    repository (HEAD, index and untracked state, which git answers from its
+    index stat cache, and untracked cache and fsmonitor when the repository
+    enables them) plus the size and mtime of every dirty path. ``git diff
+    HEAD`` is only re-hashed when that stat signature changes, so an
+    unchanged dirty tree costs one ``git status``. Git runs with
+    ``--no-optional-locks`` so it never takes ``index.lock`` or rewrites the
+    user's index. Other directories fall back to a path/size/mtime manifest.
+
+    Results are memoized per directory for ``ttl`` seconds, so bursts of
+    requests share one computation; edits made within that window are not
+    seen until it expires.
+    """
+
+    GIT_TIMEOUT = 10
+    # A diff hash is not reused for files modified this close to when it was taken,
+    # since a second edit in the same mtime tick would leave the stat signature unchanged
+    RACY_WINDOW_NS = 1_000_000_000
+    # Fields before the path in porcelain v2 changed, renamed and unmerged records
+    _PATH_FIELDS = {b"1": 8, b"2": 9, b"u": 10}
+    # Read-only: no index refresh and no index.lock in the user's repository
+    GIT = ("git", "--no-optional-locks")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memo = {}  # directory -> (computed_at, fingerprint)
+        self._toplevels = {}  # directory -> root of the work tree containing it
+        self._diffs = {}  # directory -> (stat signature, taken at ns, diff hash)
+        self._dir_locks = collections.defaultdict(threading.Lock)
+
+    def fingerprint(self, directory: str, ttl: float, max_files: int) -> Optional[str]:
+        """
+        Return a hex fingerprint of ``directory``, or None if it cannot be computed.
+        """
+        directory = os.path.abspath(directory)
+        if not os.path.isdir(directory):
+            return None
+
+        with self._lock:
+            dir_lock = self._dir_locks[directory]
+        # One computation per directory at a time; waiters reuse its result
+        with dir_lock:
+            with self._lock:
+                memo = self._memo.get(directory)
+            if memo is not None and time.monotonic() - memo[0] < ttl:
+                return memo[1]
+
+            fingerprint = self._git_fingerprint(directory)
+            if fingerprint is None:
+                fingerprint = self._manifest_fingerprint(directory, max_files)
+
+            with self._lock:
+                self._memo[directory] = (time.monotonic(), fingerprint)
+            return fingerprint
+
+    def _git_toplevel(self, directory: str) -> Optional[str]:
+        """Root of the work tree containing ``directory``, or None outside git."""
+        with self._lock:
+            toplevel = self._toplevels.get(directory)
+        if toplevel is not None:
+            return toplevel
+        try:
+            result = subprocess.run(
+                [*self.GIT, "rev-parse", "--show-toplevel"],
+                cwd=directory,
+                capture_output=True,
+                timeout=self.GIT_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        toplevel = os.fsdecode(result.stdout.rstrip(b"\n"))
+        with self._lock:
+            self._toplevels[directory] = toplevel
+        return toplevel
+
+    def _git_fingerprint(self, directory: str) -> Optional[str]:
+        # Status paths are relative to the work tree root, even when run from a subdirectory
+        toplevel = self._git_toplevel(directory)
+        if toplevel is None:
+            return None
+        try:
+            status = subprocess.run(
+                [*self.GIT, "status", "--porcelain=v2", "-z", "--branch", "--untracked-files=all"],
+                cwd=toplevel,
+                capture_output=True,
+                timeout=self.GIT_TIMEOUT
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if status.returncode != 0:
+            return None
+
+        digest = hashlib.sha256(b"git\0")
+        # Includes "# branch.oid <HEAD>", index hashes and every changed and untracked path
+        digest.update(status.stdout)
+
+        tokens = status.stdout.split(b"\0")
+        dirty = False
+        newest_mtime = 0
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            kind = token[:1]
+            if token.startswith(b"? "):
+                # Untracked content is not covered by git diff; use its stat signature
+                path = token[2:]
+            elif kind in self._PATH_FIELDS and token[1:2] == b" ":
+                dirty = True
+                path = token.split(b" ", self._PATH_FIELDS[kind])[-1]
+                if kind == b"2":
+                    # Renames carry their original path as an extra record
+                    index += 1
+            else:
+                index += 1
+                continue
+            try:
+                st = os.stat(os.path.join(toplevel, os.fsdecode(path)))
+                digest.update(f"{st.st_size}:{st.st_mtime_ns}\0".encode("ascii"))
+                newest_mtime = max(newest_mtime, st.st_mtime_ns)
+            except OSError:
+                digest.update(b"-\0")
+            index += 1
+
+        if not dirty:
+            return digest.hexdigest()
+
+        signature = digest.digest()
+        with self._lock:
+            previous = self._diffs.get(directory)
+        if previous is not None and previous[0] == signature and newest_mtime < previous[1] - self.RACY_WINDOW_NS:
+            diff_hash = previous[2]
+        else:
+            taken_at = time.time_ns()
+            diff_digest = hashlib.sha256()
+            if not self._hash_git_diff(toplevel, diff_digest):
+                return None
+            diff_hash = diff_digest.digest()
+            with self._lock:
+                self._diffs[directory] = (signature, taken_at, diff_hash)
+        digest.update(diff_hash)
+        return digest.hexdigest()
+
+    def _hash_git_diff(self, directory: str, digest) -> bool:
+        """Stream ``git diff HEAD`` into ``digest`` without buffering it."""
+        try:
+            process = subprocess.Popen(
+                [*self.GIT, "diff", "HEAD", "--binary", "--no-ext-diff", "--no-color"],
+                cwd=directory,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            return False
+        try:
+            for chunk in iter(lambda: process.stdout.read(65536), b""):
+                digest.update(chunk)
+            return process.wait(timeout=self.GIT_TIMEOUT) == 0
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            return False
+        finally:
+            process.stdout.close()
+
+    @staticmethod
+    def _manifest_fingerprint(directory: str, max_files: int) -> Optional[str]:
+        digest = hashlib.sha256(b"manifest\0")
+        seen = 0
+        pending = [directory]
+        while pending:
+            current = pending.pop()
+            try:
+                with os.scandir(current) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                seen += 1
+                if max_files and seen > max_files:
+                    # Too large to fingerprint cheaply; treat as uncacheable
+                    return None
+                digest.update(f"{entry.path}\0{st.st_size}\0{st.st_mtime_ns}\0".encode("utf-8", "surrogateescape"))
+        return digest.hexdigest()
+
+
+# Shared by every data source instance in the process
+_WORKSPACE_FINGERPRINTS = _WorkspaceFingerprinter()
+
+
+class _CodexBinaryCache:
+    """
+    Process-wide cache of where the codex binary is and what version it is.
+
+    Discovery (PATH lookup plus the well-known install locations) is memoized
+    per PATH value for a TTL, misses included. ``--version`` probes are keyed
+    on the binary's real path, inode, size and mtime, so a binary is probed
+    again only after it is replaced or upgraded. Probes can be persisted to a
+    JSON file so new processes skip them too.
+    """
+
+    VERSION_TIMEOUT = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._discovered = {}  # PATH value -> (found_at, path or None)
+        self._probes = {}  # real path -> probe dict incl. inode/size/mtime_ns
+        self._probe_locks = collections.defaultdict(threading.Lock)
+        self._persist_path = None
+
+    def configure(self, persist_path: Optional[str]) -> None:
+        """Persist probes to ``persist_path``; the first instance to set one wins."""
+        if not persist_path:
+            return
+        with self._lock:
+            if self._persist_path is not None:
+                return
+            self._persist_path = persist_path
+            try:
+                with open(persist_path, "r", encoding="utf-8") as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                return
+            for path, probe in stored.items():
+                self._probes.setdefault(path, probe)
+
+    def discover(self, candidates: Iterable[str], ttl: float) -> Optional[str]:
+        """Return the codex executable on PATH or among ``candidates``."""
+        search_path = os.environ.get("PATH", "")
+        with self._lock:
+            memo = self._discovered.get(search_path)
+        if memo is not None and time.monotonic() - memo[0] < ttl:
+            # A cached hit must still exist; a cached miss is trusted until it expires
+            if memo[1] is None or os.path.isfile(memo[1]):
+                return memo[1]
+
+        found = shutil.which("codex")
+        if not found:
+            found = next((path for path in candidates if os.path.isfile(path)), None)
+        with self._lock:
+            self._discovered[search_path] = (time.monotonic(), found)
+        return found
+
+    @staticmethod
+    def _identity(path: str) -> Optional[dict]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return {"inode": stat.st_ino, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def version(self, path: str) -> dict:
+        """
+        Return {"version": ...} for the binary at ``path``, probing only if it changed.
+
+        Failed probes (timeouts, spawn errors) are reported with an "error"
+        and not cached.
+        """
+        real_path = os.path.realpath(path)
+        with self._lock:
+            probe_lock = self._probe_locks[real_path]
+        # Concurrent callers wait for one probe instead of each spawning their own
+        with probe_lock:
+            identity = self._identity(real_path)
+            with self._lock:
+                cached = self._probes.get(real_path)
+            if identity is not None and cached is not None \
+                    and all(cached.get(key) == value for key, value in identity.items()):
+                return {"version": cached["version"]}
+
+            try:
+                result = subprocess.run(
+                    [path, "--version"],
+                    capture_output=True,
+                    text=True,
+                    timeout=self.VERSION_TIMEOUT
+                )
+            except Exception as e:
+                return {"version": "unknown", "error": str(e)}
+
+            version = result.stdout.strip() if result.returncode == 0 else "unknown"
+            if identity is not None:
+                with self._lock:
+                    self._probes[real_path] = dict(identity, version=version)
+                self._save()
+            return {"version": version}
+
+    def _save(self) -> None:
+        with self._lock:
+            path = self._persist_path
+            probes = dict(self._probes)
+        if path is None:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".codex-binaries-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(probes, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            BBLogger.log(f"Could not persist Codex binary cache to {path}: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._discovered.clear()
+            self._probes.clear()
+
+
+# Shared by every data source instance in the process
+_CODEX_BINARIES = _CodexBinaryCache()
+
+
+class _LoginFlow:
+    """
+    Background state machine around one ``codex login`` attempt.
+
+    States go idle -> pending -> authenticated or failed; a failed flow can
+    be started again, and an authenticated one is reset to idle once its
+    session expires or is rejected. Requests wait on the flow (or fail fast) instead of
+    running the login themselves.
+    """
+
+    IDLE = "idle"
+    PENDING = "pending"
+    AUTHENTICATED = "authenticated"
+    FAILED = "failed"
+
+    def __init__(self, login: Callable[[], bool]):
+        self._login = login
+        self._condition = threading.Condition()
+        self.state = self.IDLE
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self) -> str:
+        """Start the login unless it is running or already succeeded; return the state."""
+        with self._condition:
+            if self.state in (self.IDLE, self.FAILED):
+                self.state = self.PENDING
+                self.started_at = time.time()
+                threading.Thread(target=self._run, name="codex-login", daemon=True).start()
+            return self.state
+
+    def reset(self) -> None:
+        """Make a finished login restartable after its session stopped being valid."""
+        with self._condition:
+            if self.state == self.AUTHENTICATED:
+                self.state = self.IDLE
+
+    def _run(self) -> None:
+        try:
+            succeeded = self._login()
+        except Exception as e:
+            BBLogger.log(f"Error during Codex login: {e}")
+            succeeded = False
+        with self._condition:
+            self.state = self.AUTHENTICATED if succeeded else self.FAILED
+            self.finished_at = time.time()
+            self._condition.notify_all()
+
+    def wait(self, timeout: Optional[float]) -> str:
+        """Block until the login leaves the pending state or ``timeout`` passes."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.state != self.PENDING, timeout=timeout)
+            return self.state
+
+
+def _run_codex_login(codex_path: str, env: dict, timeout: float) -> bool:
+    """Run ``codex login --device-auth``, logging its output as it arrives."""
+    try:
+        # Use device-auth for better compatibility
+        BBLogger.log("Starting Codex OAuth login (device auth)...")
+        process = subprocess.Popen(
+            [codex_path, "login", "--device-auth"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=env
+        )
+        timed_out = threading.Event()
+        watchdog = threading.Timer(timeout, lambda: (timed_out.set(), process.kill()))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            # Logged as it arrives, since the device code is needed while the login is pending
+            for line in process.stdout:
+                if line.strip():
+                    BBLogger.log(f"Codex login: {line.rstrip()}")
+            process.wait()
+        finally:
+            watchdog.cancel()
+            process.stdout.close()
+
+        if timed_out.is_set():
+            BBLogger.log("Codex OAuth login timed out")
+            return False
+        if process.returncode == 0:
+            BBLogger.log("Codex OAuth login successful")
+            return True
+        BBLogger.log("Codex OAuth login failed")
+        return False
+
+    except Exception as e:
+        BBLogger.log(f"Error during Codex OAuth login: {e}")
+        return False
+
+
+class _Credential:
+    """
+    Authentication state for one auth method and account, shared by every
+    data source instance using them.
+
+    OAuth sessions are checked with ``codex login status`` at most once per
+    TTL. A check that is due soon is refreshed on a background thread, so
+    requests keep seeing a fresh result; an invalid session starts the
+    shared login flow. API keys cannot be checked without a model call and
+    count as valid until a request is rejected and calls ``invalidate``.
+    """
+
+    # Fraction of the TTL after which a used credential is re-checked in the background
+    REFRESH_AT = 0.8
+    LOGIN_TIMEOUT = 120  # 2 minutes for login
+    STATUS_TIMEOUT = 15
+
+    def __init__(self, auth_method: str, account: str, codex_path: str, env: dict, ttl: float):
+        self.auth_method = auth_method
+        self.account = account
+        self.codex_path = codex_path
+        self.env = env
+        self.ttl = ttl
+        self.valid = False
+        self.validated_at = None
+        self.login_flow = _LoginFlow(self._login)
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._used = False
+        self._refresh_timer = None
+        self.checking = False
+
+    def _probe(self) -> bool:
+        """Cheap validity check that never prompts."""
+        if self.auth_method == "api_key":
+            return True
+        try:
+            result = subprocess.run(
+                [self.codex_path, "login", "status"],
+                capture_output=True,
+                text=True,
+                timeout=self.STATUS_TIMEOUT,
+                env=self.env
+            )
+        except Exception as e:
+            BBLogger.log(f"Could not check Codex login status: {e}")
+            return False
+        return result.returncode == 0
+
+    def _login(self) -> bool:
+        if _run_codex_login(self.codex_path, self.env, self.LOGIN_TIMEOUT):
+            self._mark_valid()
+            return True
+        return False
+
+    def _mark_valid(self) -> None:
+        with self._lock:
+            self.valid = True
+            self.validated_at = time.monotonic()
+            self._used = False
+            if self._refresh_timer is not None:
+                self._refresh_timer.cancel()
+            if self.ttl > 0 and self.auth_method != "api_key":
+                self._refresh_timer = threading.Timer(self.ttl * self.REFRESH_AT, self._refresh)
+                self._refresh_timer.daemon = True
+                self._refresh_timer.start()
+
+    def _check(self, force: bool = False) -> bool:
+        """Probe once for all concurrent callers; True if the session is valid."""
+        with self._probe_lock:
+            if not force and self.is_fresh():
+                return True
+            self.checking = True
+            try:
+                valid = self._probe()
+            finally:
+                self.checking = False
+            if valid:
+                self._mark_valid()
+                return True
+            with self._lock:
+                self.valid = False
+            self.login_flow.reset()
+            return False
+
+    def _refresh(self) -> None:
+        """Timer callback: re-check ahead of expiry if the credential is still in use."""
+        with self._lock:
+            used = self._used
+        if used and not self._check(force=True):
+            BBLogger.log("Codex session expired, starting a new login in the background")
+            self.login_flow.start()
+
+    def is_fresh(self) -> bool:
+        with self._lock:
+            return self.valid and (self.ttl <= 0 or time.monotonic() - self.validated_at < self.ttl)
+
+    def status(self, wait: bool, wait_timeout: float) -> str:
+        """Return a _LoginFlow state, logging in if the session is missing or expired."""
+        with self._lock:
+            self._used = True
+        if self.is_fresh() or self._check():
+            return _LoginFlow.AUTHENTICATED
+        if self.auth_method != "oauth":
+            return _LoginFlow.FAILED
+        state = self.login_flow.start()
+        if state == _LoginFlow.PENDING and wait:
+            state = self.login_flow.wait(wait_timeout)
+        return state
+
+    def invalidate(self) -> None:
+        """Forget a session the service rejected so the next request re-checks it."""
+        with self._lock:
+            self.valid = False
+        self.login_flow.reset()
+
+    def describe(self) -> dict:
+        with self._lock:
+            age = None if self.validated_at is None else time.monotonic() - self.validated_at
+            return {
+                "auth_method": self.auth_method,
+                "account": self.account,
+                "valid": self.valid,
+                "validated_seconds_ago": age,
+                "login_state": self.login_flow.state,
+                "login_started_at": self.login_flow.started_at,
+                "login_finished_at": self.login_flow.finished_at
+            }
+
+
+class _CredentialManager:
+    """Process-wide registry of _Credential objects keyed on (auth method, account)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credentials = {}
+
+    @staticmethod
+    def account_for(auth_method: str, api_key: str, env: dict) -> str:
+        """API keys are identified by a hash, OAuth sessions by their CODEX_HOME."""
+        if auth_method == "api_key":
+            return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        home = env.get("CODEX_HOME") or os.path.join(os.path.expanduser("~"), ".codex")
+        return os.path.realpath(home)
+
+    def get(self, auth_method: str, account: str, codex_path: str, env: dict, ttl: float) -> _Credential:
+        key = (auth_method, account)
+        with self._lock:
+            credential = self._credentials.get(key)
+            if credential is None:
+                credential = self._credentials[key] = _Credential(auth_method, account, codex_path, env, ttl)
+            return credential
+
+
+# Shared by every data source instance in the process
+_CREDENTIALS = _CredentialManager()
+
+
+class _ApiKeyPool:
+    """
+    Spreads requests over several API keys.
+
+    Each request leases the key with the fewest requests in flight among
+    those not cooling down. A key that hits a rate limit cools down for
+    ``cooldown`` seconds, doubling with each consecutive rate limit; when
+    every key is cooling down, the one that recovers first is used.
+    """
+
+    MAX_BACKOFF_DOUBLINGS = 5
+
+    def __init__(self, keys: list, cooldown: float):
+        self.keys = keys
+        self.ids = [_CredentialManager.account_for("api_key", key, {}) for key in keys]
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._in_flight = [0] * len(keys)
+        self._cooldown_until = [0.0] * len(keys)
+        self._strikes = [0] * len(keys)
+        self._rate_limited = [0] * len(keys)
+        self._next = 0  # rotates ties so idle keys take turns
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def acquire(self) -> int:
+        """Lease a key and return its index; pair with ``release``."""
+        now = time.monotonic()
+        with self._lock:
+            count = len(self.keys)
+            order = [(self._next + offset) % count for offset in range(count)]
+            available = [index for index in order if self._cooldown_until[index] <= now]
+            if available:
+                index = min(available, key=lambda i: self._in_flight[i])
+            else:
+                index = min(order, key=lambda i: self._cooldown_until[i])
+            self._next = (index + 1) % count
+            self._in_flight[index] += 1
+            return index
+
+    def release(self, index: int, rate_limited: bool) -> None:
+        with self._lock:
+            self._in_flight[index] -= 1
+            if rate_limited:
+                backoff = 2 ** min(self._strikes[index], self.MAX_BACKOFF_DOUBLINGS)
+                self._cooldown_until[index] = time.monotonic() + self.cooldown * backoff
+                self._strikes[index] += 1
+                self._rate_limited[index] += 1
+            else:
+                self._strikes[index] = 0
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "key_id": self.ids[index],
+                    "in_flight": self._in_flight[index],
+                    "cooldown_remaining": max(self._cooldown_until[index] - now, 0),
+                    "rate_limited": self._rate_limited[index]
+                }
+                for index in range(len(self.keys))
+            ]
+
+
+class _AIMDLimiter:
+    """
+    Concurrency limit adjusted by additive increase, multiplicative decrease.
+
+    Every successful run adds ``increase / limit`` to the limit (about
+    ``increase`` per full window of runs); an overload signal multiplies it
+    by ``decrease``. Runs that started before the last decrease cannot cut
+    the limit again, so one burst of failures counts as one signal.
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float,
+                 increase: float = 1.0, decrease: float = 0.5):
+        self.minimum = max(1.0, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._async_waiters = []  # (loop, future) pairs woken on release
+
+    def _has_room(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self._has_room():
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> float:
+        """Block until a slot is free; returns the start time to pass to ``release``."""
+        with self._condition:
+            self._condition.wait_for(self._has_room)
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def aacquire(self) -> float:
+        """Async counterpart of ``acquire``."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._has_room():
+                    self.in_flight += 1
+                    return time.monotonic()
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._condition:
+                    if (loop, future) in self._async_waiters:
+                        self._async_waiters.remove((loop, future))
+                raise
+
+    def release(self, started_at: float, signal: Optional[str]) -> None:
+        """
+        Free a slot and adapt the limit.
+
+        Args:
+            started_at: Value returned by ``acquire``
+            signal: "success", "overload", or None for outcomes that say
+                nothing about capacity (e.g. bad credentials)
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if signal == "success":
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            elif signal == "overload" and started_at >= self._last_decrease:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = time.monotonic()
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "minimum": self.minimum,
+                "maximum": self.maximum
+            }
+
+
+class _FlightCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _SingleFlight:
+    """
+    Collapse concurrent calls that share a key into a single execution.
+
+    The first caller runs the work; callers arriving while it is in flight
+    wait for and share its result. Async callers are coalesced per event
+    loop, and the shared task is only cancelled once every waiter is gone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns:
+            Tuple of (result, whether it was shared from another caller)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    async def ado(self, key: str, factory: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Async counterpart of do; ``factory`` returns the coroutine to run."""
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, key)
+        with self._lock:
+            entry = self._async_calls.get(flight_key)
+            shared = entry is not None
+            if not shared:
+                entry = self._async_calls[flight_key] = [loop.create_task(factory()), 0]
+
+                def forget(_task, entry=entry):
+                    with self._lock:
+                        if self._async_calls.get(flight_key) is entry:
+                            del self._async_calls[flight_key]
+
+                entry[0].add_done_callback(forget)
+            entry[1] += 1
+
+        task = entry[0]
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if entry[1] == 0:
+                task.cancel()
+            raise
+
+
+class _TokenUsage:
+    """
+    Token counts reported by codex for one request.
+
+    ``turn.completed`` events carry the usage of their turn and are summed.
+    ``token_count`` events with ``info.total_token_usage`` are running totals
+    for the session, so the latest one replaces whatever was summed so far.
+    """
+
+    __slots__ = ("input_tokens", "cached_input_tokens", "output_tokens", "reasoning_output_tokens")
+
+    FIELDS = __slots__
+
+    # Event types carrying usage, decoded regardless of the retention policy
+    EVENT_TYPES = frozenset({"turn.completed", "token_count"})
+
+    def __init__(self, **counts):
+        for field in self.FIELDS:
+            setattr(self, field, int(counts.get(field) or 0))
+
+    def __bool__(self) -> bool:
+        return any(getattr(self, field) for field in self.FIELDS)
+
+    def add(self, usage: "_TokenUsage") -> None:
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(usage, field))
+
+    def observe(self, event: dict) -> None:
+        """Fold a usage-carrying codex event into the counts."""
+        if isinstance(event.get("msg"), dict):
+            event = event["msg"]
+        event_type = event.get("type")
+        if event_type == "turn.completed" and isinstance(event.get("usage"), dict):
+            self.add(_TokenUsage(**event["usage"]))
+        elif event_type == "token_count":
+            info = event.get("info")
+            if isinstance(info, dict) and isinstance(info.get("total_token_usage"), dict):
+                self.__init__(**info["total_token_usage"])
+            elif any(field in event for field in self.FIELDS):
+                self.add(_TokenUsage(**event))
+
+    def cost(self, prices: Optional[dict]) -> Optional[float]:
+        """
+        Price the usage with per-million-token rates.
+
+        ``prices`` has "input", "cached_input" and "output" rates; cached
+        input defaults to the input rate and reasoning is billed as output.
+        """
+        if not prices:
+            return None
+        input_rate = float(prices.get("input", 0))
+        cached_rate = float(prices.get("cached_input", input_rate))
+        output_rate = float(prices.get("output", 0))
+        uncached = max(self.input_tokens - self.cached_input_tokens, 0)
+        return (uncached * input_rate
+                + self.cached_input_tokens * cached_rate
+                + self.output_tokens * output_rate) / 1_000_000
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class _UsageLedger:
+    """Per-instance token totals, overall, per model and over a rolling window."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._total = _TokenUsage()
+        self._by_model = {}
+        self._recent = collections.deque()
+
+    def record(self, model: str, usage: _TokenUsage) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._requests += 1
+            self._total.add(usage)
+            self._by_model.setdefault(model, _TokenUsage()).add(usage)
+            self._recent.append((now, model, usage))
+            self._expire(now)
+
+    def _expire(self, now: float) -> None:
+        while self._recent and now - self._recent[0][0] > self.window:
+            self._recent.popleft()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            window_total = _TokenUsage()
+            window_by_model = {}
+            for _, model, usage in self._recent:
+                window_total.add(usage)
+                window_by_model.setdefault(model, _TokenUsage()).add(usage)
+            return {
+                "requests": self._requests,
+                "total": self._total.to_dict(),
+                "by_model": {model: usage.to_dict() for model, usage in self._by_model.items()},
+                "window": {
+                    "seconds": self.window,
+                    "requests": len(self._recent),
+                    "total": window_total.to_dict(),
+                    "by_model": {model: usage.to_dict() for model, usage in window_by_model.items()}
+                }
+            }
+
+
+class _EventRetention:
+    """
+    Decides which codex events are kept in full, summarized, or dropped.
+
+    Built from the ``event_retention`` param: either a preset name ("all",
+    "summary", "none") or a dict with "keep", "summarize" and "drop" lists
+    of event types plus a "default" action for unlisted types.
+    """
+
+    __slots__ = ("keep", "summarize", "drop", "default")
+
+    PRESETS = {"all": "keep", "summary": "summarize", "none": "drop"}
+
+    # Decoded even when dropped, because the response text is read from them
+    # Error and retry notices, e.g. codex backing off from a 429 before it succeeds
+    ERROR_TYPES = frozenset({"error", "stream_error"})
+
+    ALWAYS_DECODE = frozenset({"message"}) | _TokenUsage.EVENT_TYPES | ERROR_TYPES
+
+    # Longest string value kept in a summarized event
+    SUMMARY_MAX_STRING = 200
+
+    def __init__(self, policy: Any = None):
+        if policy is None or isinstance(policy, str):
+            policy = {"default": self.PRESETS.get(policy or "all", "keep")}
+        self.keep = frozenset(policy.get("keep", ()))
+        self.summarize = frozenset(policy.get("summarize", ()))
+        self.drop = frozenset(policy.get("drop", ()))
+        self.default = policy.get("default", "keep")
+        if self.default not in ("keep", "summarize", "drop"):
+            raise ValueError(f"Unknown event retention action: {self.default}")
+
+    @property
+    def keeps_everything(self) -> bool:
+        return self.default == "keep" and not self.summarize and not self.drop
+
+    @staticmethod
+    def event_type(event: dict) -> str:
+        event_type = event.get("type")
+        if event_type is None and isinstance(event.get("msg"), dict):
+            event_type = event["msg"].get("type")
+        return str(event_type or "")
+
+    def action(self, event_type: str) -> str:
+        if event_type in self.keep:
+            return "keep"
+        if event_type in self.summarize:
+            return "summarize"
+        if event_type in self.drop:
+            return "drop"
+        return self.default
+
+    def skip_decode(self, event_type: str) -> bool:
+        """True if a line of this type can be discarded without decoding it."""
+        return event_type not in self.ALWAYS_DECODE and self.action(event_type) == "drop"
+
+    def defer_decode(self, event_type: str) -> bool:
+        """True if a line of this type can be stored verbatim without decoding it."""
+        return event_type not in self.ALWAYS_DECODE and self.action(event_type) == "keep"
+
+    @classmethod
+    def summarize_event(cls, event: dict, depth: int = 0) -> dict:
+        """Keep scalar fields and short strings, e.g. a command's exit code and duration."""
+        summary = {}
+        for key, value in event.items():
+            if value is None or isinstance(value, (bool, int, float)):
+                summary[key] = value
+            elif isinstance(value, str):
+                if len(value) <= cls.SUMMARY_MAX_STRING:
+                    summary[key] = value
+            elif isinstance(value, dict) and depth < 2:
+                summary[key] = cls.summarize_event(value, depth + 1)
+        return summary
+
+    def apply(self, event: dict) -> Optional[dict]:
+        """Return the event as it should be retained, or None to drop it."""
+        action = self.action(self.event_type(event))
+        if action == "keep":
+            return event
+        if action == "summarize":
+            summary = self.summarize_event(event)
+            summary["summarized"] = True
+            return summary
+        return None
+
+
+class _RunOutput:
+    """Accumulates one run's assistant text, retained events and token usage."""
+
+    __slots__ = ("events", "text_parts", "streaming", "message", "spill_threshold", "spill_directory", "timer",
+                 "usage", "errors")
+
+    def __init__(self, message: str, streaming: bool, lazy: bool,
+                 spill_threshold: int = 0, spill_directory: Optional[str] = None,
+                 timer: Optional[_PhaseTimer] = None):
+        self.timer = timer or _PhaseTimer()
+        self.events = _EventBuffer() if lazy else []
+        self.text_parts = []
+        self.usage = _TokenUsage()
+        self.errors = []
+        self.streaming = streaming
+        self.message = message
+        self.spill_threshold = spill_threshold
+        self.spill_directory = spill_directory
+
+    def check_spill(self, stdout_bytes: int) -> None:
+        """Move retained events to a temp file once stdout passes the spill threshold."""
+        if not self.spill_threshold or stdout_bytes <= self.spill_threshold:
+            return
+        if isinstance(self.events, list):
+            self.events = _EventBuffer.from_events(self.events)
+        if not self.events.spilled:
+            BBLogger.log(f"Codex output passed {self.spill_threshold} bytes, spilling events to disk")
+            self.events.spill(self.spill_directory)
+
+    def parsed(self) -> dict:
+        return {"events": self.events, "assistant_message": "".join(self.text_parts), "usage": self.usage,
+                "errors": self.errors}
+
+
+class _PromptSource:
+    """
+    A prompt held inline, stored in a file, or produced chunk by chunk.
+
+    File and stream prompts are only ever read in ``CHUNK_SIZE`` pieces
+    while being written to the child's stdin, so they never exist as one
+    Python string.
+    """
+
+    __slots__ = ("text", "path", "stream", "label")
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, text: Optional[str] = None, path: Optional[str] = None, stream: Any = None):
+        self.text = text
+        self.path = path
+        self.stream = stream
+        if text is not None:
+            self.label = text
+        elif path is not None:
+            self.label = str(path)
+        else:
+            self.label = "<stream>"
+
+    @property
+    def inline(self) -> bool:
+        return self.text is not None
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """Yield the prompt as UTF-8 encoded chunks."""
+        if self.text is not None:
+            for start in range(0, len(self.text), self.CHUNK_SIZE):
+                yield self.text[start:start + self.CHUNK_SIZE].encode("utf-8")
+        elif self.path is not None:
+            with open(self.path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                    yield chunk
+        elif hasattr(self.stream, "read"):
+            for chunk in iter(lambda: self.stream.read(self.CHUNK_SIZE), ""):
+                if not chunk:
+                    break
+                yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        else:
+            for chunk in self.stream:
+                yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+class _Cassette:
+    """
+    JSON-lines file of recorded ``codex exec`` runs, used for record and replay.
+
+    Each line holds one run: argv, environment variable names (never their
+    values), exit status, stderr and every stdout line with its offset in
+    seconds from process start.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str, load: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = []
+        self._by_prompt = {}
+        self._cursors = collections.defaultdict(int)
+        if load:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._records.append(json.loads(line))
+            for index, record in enumerate(self._records):
+                self._by_prompt.setdefault(record.get("prompt_sha256"), []).append(index)
+
+    @staticmethod
+    def prompt_hash(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(dict(record, version=self.VERSION)) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def select(self, prompt: str) -> Optional[dict]:
+        """
+        Pick the run to replay for a prompt: the recordings of the same prompt
+        in turn, or every recording in turn when the prompt was never seen.
+        """
+        key = self.prompt_hash(prompt)
+        with self._lock:
+            candidates = self._by_prompt.get(key)
+            if candidates is None:
+                if not self._records:
+                    return None
+                key = None
+                candidates = range(len(self._records))
+            cursor = self._cursors[key]
+            self._cursors[key] = cursor + 1
+            return self._records[candidates[cursor % len(candidates)]]
+
+
+class _CassetteRecording:
+    """Captures one live run's stdout lines and timing for a cassette."""
+
+    __slots__ = ("cassette", "record", "started", "_pending")
+
+    def __init__(self, cassette: _Cassette, cmd: list, env: dict, prompt: str, model: Optional[str]):
+        self.cassette = cassette
+        self.record = {
+            "recorded_at": time.time(),
+            "argv": list(cmd),
+            "env_keys": sorted(env),
+            "prompt_sha256": _Cassette.prompt_hash(prompt),
+            "model": model,
+            "events": []
+        }
+        self.started = time.monotonic()
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> None:
+        offset = round(time.monotonic() - self.started, 6)
+        lines = (self._pending + chunk).split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self.record["events"].append([offset, line.decode("utf-8", errors="replace")])
+
+    def finish(self, return_code: Optional[int], stderr: str, timed_out: bool = False) -> None:
+        if self._pending:
+            self.feed(b"\n")
+        self.record.update(
+            duration=round(time.monotonic() - self.started, 6),
+            return_code=return_code,
+            timed_out=timed_out,
+            stderr=stderr
+        )
+        try:
+            self.cassette.append(self.record)
+        except OSError as e:
+            BBLogger.log(f"Could not write Codex cassette {self.cassette.path}: {e}")
+
+
+class _RequestScheduler:
+    """
+    Priority and deadline aware dispatcher in front of _process_message.
+
+    Requests are ordered by priority class, then earliest deadline first,
+    then arrival order. Requests whose deadline has already passed are
+    failed without running Codex, both on submit and again when a worker
+    picks them up.
+    """
+
+    PRIORITY_CLASSES = {"interactive": 0, "default": 1, "batch": 2}
+
+    def __init__(self, handler: Callable[[Any], dict], workers: int):
+        self._handler = handler
+        self._worker_count = workers
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+        self.expired = 0
+
+    @classmethod
+    def priority_value(cls, priority: Any) -> int:
+        if isinstance(priority, str):
+            if priority not in cls.PRIORITY_CLASSES:
+                raise ValueError(f"Unknown priority class: {priority}")
+            return cls.PRIORITY_CLASSES[priority]
+        return int(priority)
+
+    @staticmethod
+    def _expired_result(message: Any) -> dict:
+        return {
+            "error": True,
+            "error_type": "deadline_exceeded",
+            "message": "Request deadline passed before Codex could run it",
+            "original_message": SubjectiveCodexDataSource._normalize_message(message)
+        }
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self._worker_count:
+            thread = threading.Thread(target=self._work, name=f"codex-scheduler-{len(self._threads)}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, message: Any, priority: int, deadline: Optional[float],
+               callback: Optional[Callable[[dict], None]]) -> Future:
+        """Queue a message; ``deadline`` is a time.monotonic() value or None."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        if deadline is not None and time.monotonic() >= deadline:
+            self.expired += 1
+            self._resolve(future, callback, self._expired_result(message))
+            return future
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Codex request scheduler is stopped")
+            sort_deadline = deadline if deadline is not None else math.inf
+            heapq.heappush(self._heap, (priority, sort_deadline, next(self._sequence),
+                                        message, deadline, future, callback))
+            self._start_workers()
+            self._condition.notify()
+        return future
+
+    @staticmethod
+    def _resolve(future: Future, callback: Optional[Callable], result: dict) -> None:
+        future.set_result(result)
+        if callback:
+            try:
+                callback(result)
+            except Exception as e:
+                BBLogger.log(f"Error in scheduled Codex response callback: {e}")
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._heap and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                _, _, _, message, deadline, future, callback = heapq.heappop(self._heap)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                self.expired += 1
+                self._resolve(future, callback, self._expired_result(message))
+                continue
+
+            try:
+                result = self._handler(message)
+            except Exception as e:
+                result = {
+                    "error": True,
+                    "error_type": "exception",
+                    "message": str(e),
+                    "original_message": SubjectiveCodexDataSource._normalize_message(message)
+                }
+            self._resolve(future, callback, result)
+
+    def queue_depth(self) -> int:
+        with self._condition:
+            return len(self._heap)
+
+    def close(self) -> None:
+        """Stop the workers and fail every request still queued."""
+        with self._condition:
+            self._closed = True
+            pending, self._heap = self._heap, []
+            self._condition.notify_all()
+        for _, _, _, message, _, future, callback in pending:
+            self._resolve(future, callback, {
+                "error": True,
+                "error_type": "cancelled",
+                "message": "Codex data source stopped before the request ran",
+                "original_message": SubjectiveCodexDataSource._normalize_message(message)
+            })
+
 
 class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
     """
@@ -15,6 +2424,9 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
     Uses 'codex exec' for stateless message processing.
     """
 
+    # Bytes requested per read from a Codex child's stdout
+    READ_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, name=None, session=None, dependency_data_sources=None,
                  subscribers=None, params=None):
         super().__init__(
@@ -29,6 +2441,16 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
         self.auth_method = self.params.get("auth_method", "api_key")
         self.api_key = self.params.get("api_key", "")
 
+        # Several keys are balanced per request; api_key, if set, joins them
+        api_keys = self.params.get("api_keys") or []
+        if isinstance(api_keys, str):
+            api_keys = re.split(r"[\s,]+", api_keys)
+        api_keys = list(dict.fromkeys(key for key in [self.api_key, *api_keys] if key))
+        self.api_key = self.api_key or (api_keys[0] if api_keys else "")
+        self._api_keys = None
+        if self.auth_method == "api_key" and len(api_keys) > 1:
+            self._api_keys = _ApiKeyPool(api_keys, float(self.params.get("api_key_cooldown", 30) or 0))
+
         # Codex CLI settings
         self.model = self.params.get("model", "o4-mini")
         self.sandbox_mode = self.params.get("sandbox_mode", "read-only")
@@ -39,22 +2461,139 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
         self.full_auto = self.params.get("full_auto", False)
         self.enable_search = self.params.get("enable_search", False)
 
-        # Track authentication status
-        self._authenticated = False
-        self._codex_path = None
+        # Warm worker pool (0 disables it and spawns one 'codex exec' per message)
+        self.pool_size = int(self.params.get("pool_size", 0) or 0)
+        self.pool_max_jobs = int(self.params.get("pool_max_jobs", 100) or 0)
+        self.pool_max_age = float(self.params.get("pool_max_age", 3600) or 0)
+        self.pool_health_interval = float(self.params.get("pool_health_interval", 30) or 0)
+
+        # Authentication state is shared per account; OAuth login runs in the background
+        self.auth_wait = self.params.get("auth_wait", "queue")  # or "fail_fast"
+        self.auth_wait_timeout = float(self.params.get("auth_wait_timeout", 150) or 0)
+        self.auth_check_ttl = float(self.params.get("auth_check_ttl", 300) or 0)
+        self._credential_ref = None
+
+        # Per-tenant Codex config/session directory, kept apart from ~/.codex
+        self.codex_home = self.params.get("codex_home") or None
+        if self.codex_home:
+            self.codex_home = os.path.abspath(os.path.expanduser(self.codex_home))
+            os.makedirs(self.codex_home, mode=0o700, exist_ok=True)
+        self._env = self._snapshot_env()
+        self._key_envs = [self._snapshot_env(key) for key in self._api_keys.keys] if self._api_keys else []
+        # An explicit codex_path skips discovery, e.g. to use a specific build or a stand-in
+        self._codex_path = self.params.get("codex_path") or None
+        self.discovery_ttl = float(self.params.get("discovery_ttl", 60) or 0)
+        _CODEX_BINARIES.configure(os.path.expanduser(self.params.get("binary_cache_path") or "") or None)
+        self._worker_pool = None
+        self._worker_pool_lock = threading.Lock()
+
+        # Streaming: push partial output to subscribers/callback while Codex runs
+        self.stream_events = self.params.get("stream_events", False)
+        self._stream_callback = None
+
+        # Native asyncio execution (aprocess_message / asend_message)
+        self.async_concurrency = max(1, int(self.params.get("async_concurrency", 16) or 1))
+        self._async_semaphore = None
+        self._async_semaphore_loop = None
+
+        # NDJSON decoding backend: "auto" uses orjson when installed
+        self.json_backend = self.params.get("json_backend", "auto")
+        self._json_loads = _json_loads_for(self.json_backend)
+
+        # Return CodexResult objects that decode events on access instead of dicts
+        self.lazy_results = self.params.get("lazy_results", False)
+
+        # Runs whose stdout passes this many bytes keep their events in an mmap'd temp file;
+        # results stay plain dicts unless lazy_results is set, with a lazy "events" sequence
+        self.spill_threshold_bytes = int(self.params.get("spill_threshold_bytes", 64 * 1024 * 1024) or 0)
+        self.spill_directory = self.params.get("spill_directory")
+
+        # Which events are returned in full, summarized or dropped
+        self._event_retention = _EventRetention(self.params.get("event_retention"))
+
+        # Prompt delivery: "auto" switches from argv to stdin for large prompts
+        self.prompt_via_stdin = self.params.get("prompt_via_stdin", "auto")
+        self.stdin_prompt_threshold = int(self.params.get("stdin_prompt_threshold", 32 * 1024) or 0)
+
+        # Priority/deadline scheduler used by schedule_message
+        self.scheduler_workers = max(1, int(self.params.get("scheduler_workers", 4) or 1))
+        self._scheduler = None
+        self._scheduler_lock = threading.Lock()
+
+        # Adaptive (AIMD) limit on concurrent Codex runs, driven by rate-limit/overload signals
+        self._limiter = None
+        if self.params.get("adaptive_concurrency", False):
+            self._limiter = _AIMDLimiter(
+                initial=float(self.params.get("adaptive_initial", 4) or 1),
+                minimum=float(self.params.get("adaptive_min", 1) or 1),
+                maximum=float(self.params.get("adaptive_max", 64) or 1),
+                decrease=float(self.params.get("adaptive_decrease", 0.5) or 0.5)
+            )
+
+        # Default parallelism for process_batch
+        self.batch_concurrency = max(1, int(self.params.get("batch_concurrency", 4) or 1))
+
+        # Response cache; only sandbox modes without side effects are cached
+        self.cache_enabled = self.params.get("cache_enabled", False)
+        self.cacheable_sandbox_modes = set(self.params.get("cacheable_sandbox_modes", ["read-only"]))
+        self._response_cache = _ResponseCache(
+            max_entries=int(self.params.get("cache_max_entries", 256) or 0),
+            max_bytes=int(self.params.get("cache_max_bytes", 64 * 1024 * 1024) or 0),
+            ttl=float(self.params.get("cache_ttl", 3600) or 0)
+        )
+        self.coalesce_requests = self.params.get("coalesce_requests", True)
+        self._single_flight = _SingleFlight()
+        self.cache_workspace_fingerprint = self.params.get("cache_workspace_fingerprint", True)
+        # Cached responses can outlive working tree edits by up to this many seconds
+        self.workspace_fingerprint_ttl = float(self.params.get("workspace_fingerprint_ttl", 2) or 0)
+        self.workspace_fingerprint_max_files = int(self.params.get("workspace_fingerprint_max_files", 20000) or 0)
+        self._disk_cache = None
+        disk_cache_path = self.params.get("disk_cache_path")
+        if self.cache_enabled and disk_cache_path:
+            try:
+                self._disk_cache = _DiskResponseCache(
+                    path=os.path.expanduser(disk_cache_path),
+                    max_bytes=int(self.params.get("disk_cache_max_bytes", 512 * 1024 * 1024) or 0),
+                    ttl=self._response_cache.ttl
+                )
+            except (sqlite3.Error, OSError) as e:
+                BBLogger.log(f"Disk response cache disabled, could not open {disk_cache_path}: {e}")
+
+        # Record/replay of codex exec runs; replay_speed 0 replays without delays
+        self.replay_speed = float(self.params.get("replay_speed", 1.0) or 0)
+        self._record_cassette = None
+        self._replay_cassette = None
+        if self.params.get("record_path"):
+            self._record_cassette = _Cassette(os.path.expanduser(self.params["record_path"]))
+        if self.params.get("replay_path"):
+            self._replay_cassette = _Cassette(os.path.expanduser(self.params["replay_path"]), load=True)
+            BBLogger.log(f"Replaying {len(self._replay_cassette)} recorded Codex runs")
+
+        # Token accounting; token_prices maps a model to per-million-token rates
+        self.token_prices = dict(self.params.get("token_prices") or {})
+        self._usage_ledger = _UsageLedger(window=float(self.params.get("usage_window", 3600) or 0))
+
+        # Get the device login going before the first request needs it
+        if self.auth_method == "oauth" and self.params.get("auth_on_start", True):
+            self.start_authentication()
+
+        # Metrics are process-wide; the exporter is started by the first instance asking for it
+        _METRICS.add_collector(self._collect_metrics)
+        self.metrics_port = self.params.get("metrics_port")
+        if self.metrics_port is not None:
+            try:
+                self.metrics_port = _METRICS.serve(int(self.metrics_port),
+                                                   self.params.get("metrics_host", "127.0.0.1"))
+                BBLogger.log(f"Serving Codex metrics on port {self.metrics_port}")
+            except OSError as e:
+                BBLogger.log(f"Could not start metrics exporter on port {self.metrics_port}: {e}")
 
     def _find_codex_cli(self) -> Optional[str]:
         """Find the codex CLI executable."""
         if self._codex_path:
             return self._codex_path
 
-        # Check if codex is in PATH
-        codex_path = shutil.which("codex")
-        if codex_path:
-            self._codex_path = codex_path
-            return codex_path
-
-        # Check common installation locations
+        # Check PATH, then common installation locations; shared across instances
         common_paths = [
             os.path.expanduser("~/.local/bin/codex"),
             os.path.expanduser("~/bin/codex"),
@@ -62,204 +2601,1039 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
             "C:\\Program Files\\codex\\codex.exe",
             os.path.expanduser("~\\AppData\\Local\\Programs\\codex\\codex.exe"),
         ]
+        codex_path = _CODEX_BINARIES.discover(common_paths, ttl=self.discovery_ttl)
+        if codex_path:
+            self._codex_path = codex_path
+        return codex_path
+
+    def _ensure_authenticated(self) -> bool:
+        """Ensure the Codex CLI is authenticated."""
+        return self._auth_status() == _LoginFlow.AUTHENTICATED
+
+    def _credential(self) -> Optional[_Credential]:
+        """The shared credential for this instance's auth method and account, None if unusable."""
+        if self._credential_ref is not None:
+            return self._credential_ref
+        codex_path = self._find_codex_cli()
+        if not codex_path:
+            BBLogger.log("Codex CLI not found. Please install it first.")
+            return None
+        if self.auth_method == "api_key":
+            if not self.api_key:
+                return None
+            # API key auth - passed to children through this instance's environment only
+            BBLogger.log("Using API key authentication for Codex CLI")
+        elif self.auth_method != "oauth":
+            return None
+        env = self._build_env()
+        account = _CREDENTIALS.account_for(self.auth_method, self.api_key, env)
+        self._credential_ref = _CREDENTIALS.get(self.auth_method, account, codex_path, env, self.auth_check_ttl)
+        return self._credential_ref
+
+    @property
+    def _authenticated(self) -> bool:
+        credential = self._credential_ref
+        return credential is not None and credential.is_fresh()
+
+    def _auth_status(self) -> str:
+        """
+        Authenticate if needed and return a _LoginFlow state.
+
+        OAuth logins run on a background thread. With ``auth_wait`` "queue"
+        callers wait up to ``auth_wait_timeout`` seconds for it; with
+        "fail_fast" they get "pending" straight away.
+        """
+        credential = self._credential()
+        if credential is None:
+            return _LoginFlow.FAILED
+        return credential.status(wait=self.auth_wait != "fail_fast", wait_timeout=self.auth_wait_timeout)
+
+    def start_authentication(self) -> str:
+        """
+        Start authenticating in the background without waiting for it.
+
+        Returns:
+            The login state: "authenticated", "pending" or "failed"
+        """
+        credential = self._credential()
+        if credential is None:
+            return _LoginFlow.FAILED
+        if credential.is_fresh():
+            return _LoginFlow.AUTHENTICATED
+        threading.Thread(target=credential.status, args=(False, 0), name="codex-auth", daemon=True).start()
+        return _LoginFlow.PENDING
+
+    def get_auth_status(self) -> dict:
+        """
+        Return the authentication state without blocking.
+
+        Returns:
+            Dictionary with auth method, account, state, session validity and
+            login start/finish times
+        """
+        credential = self._credential_ref
+        if credential is None:
+            return {"auth_method": self.auth_method, "state": _LoginFlow.IDLE}
+        status = credential.describe()
+        if status["valid"]:
+            status["state"] = _LoginFlow.AUTHENTICATED
+        elif credential.checking:
+            status["state"] = _LoginFlow.PENDING
+        elif status["login_state"] == _LoginFlow.AUTHENTICATED:
+            # The last login's session has since expired or been rejected
+            status["state"] = _LoginFlow.IDLE
+        else:
+            status["state"] = status["login_state"]
+        return status
+
+    def _auth_error(self, state: str, message: str) -> dict:
+        """Response for a request that could not be authenticated."""
+        if state == _LoginFlow.PENDING:
+            return {
+                "error": True,
+                "error_type": "authentication_pending",
+                "message": "Codex login is still in progress. Complete the device login and retry.",
+                "original_message": message
+            }
+        return {
+            "error": True,
+            "error_type": "authentication_error",
+            "message": "Failed to authenticate with Codex CLI. Please check your credentials.",
+            "original_message": message
+        }
+
+    # stderr lines codex writes for a failed turn, optionally after a log timestamp/level prefix;
+    # everything else on stderr (tool output, progress, warnings) is ignored when classifying
+    ERROR_LINE_PATTERN = re.compile(
+        r"^(?:\[[^\]]*\]\s*|\d\S*\s+)*(?:error|stream error|fatal)\b.*$",
+        re.IGNORECASE | re.MULTILINE
+    )
+
+    # Error text of a run the service refused because the session or key is no longer valid
+    AUTH_FAILURE_PATTERN = re.compile(
+        r"\b(status|http|code)\W{0,3}401\b|401 unauthori[sz]ed|unauthori[sz]ed|not logged in|"
+        r"invalid api key|incorrect api key|(token|session) (has )?expired|codex login",
+        re.IGNORECASE
+    )
+
+    # Error text of a run refused for exceeding a rate limit or quota
+    RATE_LIMIT_PATTERN = re.compile(
+        r"\b(status|http|code)\W{0,3}429\b|429 too many requests|too many requests|rate.?limit|"
+        r"quota|tokens per min|requests per min",
+        re.IGNORECASE
+    )
+
+    # Error text of server-side overload or a dropped connection to the service
+    OVERLOAD_PATTERN = re.compile(
+        r"\b(status|http|code)\W{0,3}(500|502|503|504|529)\b|overloaded|internal server error|"
+        r"service unavailable|bad gateway|gateway timeout|stream disconnected|"
+        r"connection (reset|refused|closed)",
+        re.IGNORECASE
+    )
+
+    def _failure_text(self, result: dict) -> str:
+        """The error events and error lines of a failed run, without unrelated stderr."""
+        texts = list(result.get("error_events") or ())
+        if result.get("error_type") == "execution_error":
+            message = str(result.get("message", ""))
+            if "return_code" in result:
+                # The message is the process's whole stderr
+                texts.extend(match.group(0) for match in self.ERROR_LINE_PATTERN.finditer(message))
+            else:
+                # Error text the MCP server or worker reported for the turn
+                texts.append(message)
+        return "\n".join(texts)
+
+    def _classify_failure(self, result: dict) -> Optional[str]:
+        """
+        Classify why a run failed or struggled.
+
+        Looks at codex's error/stream_error events (which it also emits for
+        retries that eventually succeeded), the error lines of stderr and
+        the exit code. A run that hit this data source's own timeout says
+        nothing about the service's capacity.
+
+        Returns:
+            "rate_limited", "overloaded", "auth", or None when the run gives
+            no capacity signal
+        """
+        text = self._failure_text(result)
+        killed = (result.get("return_code") or 0) < 0
+        if not text:
+            # Killed by a signal, e.g. the OOM killer
+            return "overloaded" if killed else None
+        if self.RATE_LIMIT_PATTERN.search(text):
+            return "rate_limited"
+        if self.OVERLOAD_PATTERN.search(text):
+            return "overloaded"
+        if result.get("error_type") == "execution_error" and self.AUTH_FAILURE_PATTERN.search(text):
+            return "auth"
+        return "overloaded" if killed else None
+
+    def _is_rate_limited(self, result: dict) -> bool:
+        return self._classify_failure(result) == "rate_limited"
+
+    def _check_auth_failure(self, result: dict) -> None:
+        """Invalidate the shared credential when a run failed for authentication reasons."""
+        if self._credential_ref is None:
+            return
+        if self._classify_failure(result) == "auth":
+            BBLogger.log("Codex rejected the credentials, they will be re-checked on the next request")
+            self._credential_ref.invalidate()
+
+    def _trigger_oauth_login(self) -> bool:
+        """Trigger the OAuth login flow for Codex CLI."""
+        credential = self._credential()
+        if credential is None or self.auth_method != "oauth":
+            return False
+        credential.login_flow.start()
+        return credential.login_flow.wait(None) == _LoginFlow.AUTHENTICATED
+
+    def _build_command(self, message: Optional[str]) -> list:
+        """Build the codex exec command with all options; None reads the prompt from stdin."""
+        codex_path = self._find_codex_cli()
+        if not codex_path:
+            raise RuntimeError("Codex CLI not found")
+
+        cmd = [codex_path, "exec"]
+
+        # Add JSON output for parsing
+        cmd.append("--json")
+
+        # Add model selection
+        if self.model:
+            cmd.extend(["--model", self.model])
+
+        # Add sandbox mode
+        if self.sandbox_mode:
+            cmd.extend(["--sandbox", self.sandbox_mode])
+
+        # Add full-auto mode if enabled
+        if self.full_auto:
+            cmd.append("--full-auto")
+
+        # Add search if enabled
+        if self.enable_search:
+            cmd.append("--search")
+
+        # Add working directory
+        if self.working_directory:
+            cmd.extend(["--cd", self.working_directory])
+
+        # Add the prompt, or "-" to have codex read it from stdin
+        cmd.append("-" if message is None else message)
+
+        return cmd
+
+    def _build_env(self) -> collections.abc.Mapping:
+        """
+        Return the environment passed to Codex child processes.
+
+        A read-only snapshot taken at construction, so instances with
+        different keys or CODEX_HOMEs can run concurrently without touching
+        ``os.environ``.
+        """
+        return self._env
+
+    def _env_for(self, key_index: Optional[int]) -> collections.abc.Mapping:
+        """The environment for a request holding a leased key, or the default one."""
+        return self._build_env() if key_index is None else self._key_envs[key_index]
+
+    def _snapshot_env(self, api_key: Optional[str] = None) -> collections.abc.Mapping:
+        env = os.environ.copy()
+        api_key = api_key or self.api_key
+        if self.auth_method == "api_key" and api_key:
+            env["OPENAI_API_KEY"] = api_key
+        if self.codex_home:
+            env["CODEX_HOME"] = self.codex_home
+        return types.MappingProxyType(env)
+
+    def _get_worker_pool(self) -> _CodexWorkerPool:
+        """Create the warm worker pool on first use."""
+        with self._worker_pool_lock:
+            if self._worker_pool is None:
+                codex_path = self._find_codex_cli()
+                if not codex_path:
+                    raise RuntimeError("Codex CLI not found")
+                # Workers keep their environment for life, so keys are dealt out per worker
+                envs = itertools.cycle(self._key_envs or [self._build_env()])
+                cwd = self.working_directory if os.path.isdir(self.working_directory) else None
+                self._worker_pool = _CodexWorkerPool(
+                    factory=lambda: _CodexWorker(codex_path, next(envs), cwd, startup_timeout=60),
+                    size=self.pool_size,
+                    max_jobs=self.pool_max_jobs,
+                    max_age=self.pool_max_age,
+                    health_interval=self.pool_health_interval
+                )
+                self._worker_pool.prewarm()
+                BBLogger.log(f"Started Codex worker pool with {self.pool_size} workers")
+            return self._worker_pool
+
+    def _build_pool_arguments(self, message: str) -> dict:
+        """Build the ``codex`` tool arguments equivalent to ``_build_command``."""
+        arguments = {"prompt": message, "approval-policy": "never"}
+        if self.model:
+            arguments["model"] = self.model
+        if self.sandbox_mode:
+            arguments["sandbox"] = self.sandbox_mode
+        if self.working_directory:
+            arguments["cwd"] = self.working_directory
+        if self.full_auto and self.sandbox_mode == "read-only":
+            # Mirrors --full-auto, which implies a writable workspace sandbox
+            arguments["sandbox"] = "workspace-write"
+        if self.enable_search:
+            arguments["config"] = {"tools": {"web_search": True}}
+        return arguments
+
+    def _process_via_pool(self, message: str, timer: Optional[_PhaseTimer] = None) -> dict:
+        """Process a message on a warm pooled worker instead of spawning ``codex exec``."""
+        timer = timer or _PhaseTimer()
+        streaming = self.stream_events or self._stream_callback is not None
+        pool = None
+        worker = None
+        healthy = False
+
+        def on_event(event):
+            timer.mark("first_byte")
+            if self._extract_text_delta(event) or event.get("type") == "agent_message":
+                timer.mark("first_token")
+            if streaming:
+                self._publish_stream_event(self._stream_payload(event, message))
+
+        try:
+            pool = self._get_worker_pool()
+            arguments = self._build_pool_arguments(message)
+            timer.mark("built")
+            worker = pool.checkout(timeout=self.timeout)
+            timer.mark("spawned")
+            run = worker.run(arguments, timeout=self.timeout, on_event=on_event)
+            timer.mark("exited")
+            healthy = True
+
+            if run["is_error"]:
+                return {
+                    "error": True,
+                    "error_type": "execution_error",
+                    "message": run["text"] or "Codex execution failed",
+                    "original_message": message
+                }
+
+            response = run["text"]
+            if not response:
+                response = "".join(
+                    event.get("message", "") for event in run["events"]
+                    if event.get("type") == "agent_message"
+                )
+            usage = _TokenUsage()
+            errors = []
+            for event in run["events"]:
+                event_type = _EventRetention.event_type(event)
+                if event_type in _TokenUsage.EVENT_TYPES:
+                    usage.observe(event)
+                elif event_type in _EventRetention.ERROR_TYPES:
+                    errors.append(self._event_error_message(event))
+            events = self._retain_events(run["events"])
+            fields = {
+                "success": True,
+                "response": response,
+                "usage": self._usage_fields(usage),
+                "original_message": message
+            }
+            if errors:
+                fields["error_events"] = errors
+            if self.lazy_results:
+                buffer, offsets = _EventBuffer.from_events(events).freeze()
+                return CodexResult(fields, buffer, offsets, self._json_loads)
+            return dict(fields, events=events)
+
+        except subprocess.TimeoutExpired:
+            BBLogger.log(f"Codex worker timed out after {self.timeout} seconds")
+            return {
+                "error": True,
+                "error_type": "timeout",
+                "message": f"Codex execution timed out after {self.timeout} seconds",
+                "original_message": message
+            }
+        except _CodexWorkerError as e:
+            BBLogger.log(f"Codex worker crashed, replacing it: {e}")
+            return {
+                "error": True,
+                "error_type": "execution_error",
+                "message": str(e),
+                "original_message": message
+            }
+        except Exception as e:
+            BBLogger.log(f"Error executing Codex command on worker: {e}")
+            return {
+                "error": True,
+                "error_type": "exception",
+                "message": str(e),
+                "original_message": message
+            }
+        finally:
+            if worker is not None:
+                pool.checkin(worker, healthy=healthy)
+
+    def stop(self):
+        """Stop the data source and shut down any warm Codex workers."""
+        try:
+            super().stop()
+        finally:
+            with self._worker_pool_lock:
+                pool, self._worker_pool = self._worker_pool, None
+            if pool is not None:
+                pool.close()
+            with self._scheduler_lock:
+                scheduler, self._scheduler = self._scheduler, None
+            if scheduler is not None:
+                scheduler.close()
+            if self._disk_cache is not None:
+                self._disk_cache.close()
+                self._disk_cache = None
+
+    @staticmethod
+    def _extract_assistant_text(event: dict) -> str:
+        """Return the assistant text carried by a complete message event, if any."""
+        if event.get("type") != "message" or event.get("role") != "assistant":
+            return ""
+        return "".join(
+            item.get("text", "")
+            for item in event.get("content", [])
+            if item.get("type") == "text"
+        )
+
+    @staticmethod
+    def _extract_text_delta(event: dict) -> str:
+        """Return the partial text carried by a streaming delta event, if any."""
+        delta = event.get("delta")
+        if isinstance(delta, str) and str(event.get("type", "")).endswith("_delta"):
+            return delta
+        return ""
+
+    @staticmethod
+    def _event_error_message(event: dict) -> str:
+        """Return the text of an error or stream_error event."""
+        if isinstance(event.get("msg"), dict):
+            event = event["msg"]
+        message = event.get("message") or event.get("error") or event
+        return message if isinstance(message, str) else json.dumps(message, default=str)
+
+    def _new_parser(self, streaming: bool) -> _NDJSONParser:
+        """
+        Create an output parser that skips decoding events the retention
+        policy drops and, for lazy results, events that are kept verbatim.
+        """
+        skip = None
+        defer = None
+        if not streaming:
+            if not self._event_retention.keeps_everything:
+                skip = self._event_retention.skip_decode
+            if self.lazy_results:
+                defer = self._event_retention.defer_decode
+        return _NDJSONParser(self._json_loads, skip=skip, defer=defer)
+
+    def _retain_events(self, events: Iterable[dict]) -> list:
+        """Apply the event retention policy to already decoded events."""
+        if self._event_retention.keeps_everything:
+            return list(events)
+        retained = (self._event_retention.apply(event) for event in events)
+        return [event for event in retained if event is not None]
+
+    def set_stream_callback(self, callback: Optional[Callable[[dict], None]]) -> None:
+        """
+        Register a callback that receives partial output while Codex is running.
+
+        Args:
+            callback: Called with one payload dict per text delta, assistant
+                message or tool event, or None to disable streaming callbacks
+        """
+        self._stream_callback = callback
+
+    def _publish_stream_event(self, payload: dict) -> None:
+        """Push a partial-output payload to the stream callback and subscribers."""
+        if self._stream_callback:
+            try:
+                self._stream_callback(payload)
+            except Exception as e:
+                BBLogger.log(f"Error in Codex stream callback: {e}")
+
+        if not self.stream_events:
+            return
+        for subscriber in list(getattr(self, "subscribers", None) or []):
+            notify = getattr(subscriber, "notify", None)
+            if not callable(notify):
+                continue
+            try:
+                notify(payload)
+            except Exception as e:
+                BBLogger.log(f"Error notifying subscriber of Codex stream event: {e}")
+
+    def _stream_payload(self, event: dict, message: str) -> dict:
+        """Classify a decoded event into the payload published to stream listeners."""
+        delta = self._extract_text_delta(event)
+        if delta:
+            kind, text = "text_delta", delta
+        else:
+            text = self._extract_assistant_text(event)
+            kind = "assistant_message" if text else "event"
+        return {
+            "stream": True,
+            "kind": kind,
+            "text": text,
+            "event": event,
+            "original_message": message
+        }
+
+    def _new_run_output(self, message: str, streaming: bool,
+                        timer: Optional[_PhaseTimer] = None) -> _RunOutput:
+        return _RunOutput(message, streaming, self.lazy_results,
+                          spill_threshold=self.spill_threshold_bytes,
+                          spill_directory=self.spill_directory,
+                          timer=timer)
+
+    def _consume_event(self, event: Optional[dict], line: bytes, output: _RunOutput) -> None:
+        """Fold one codex exec event (None if its decoding was deferred) into the run state."""
+        if event is None:
+            output.events.append_line(line)
+            return
+
+        text = self._extract_assistant_text(event)
+        if text:
+            output.text_parts.append(text)
+            output.timer.mark("first_token")
+        elif self._extract_text_delta(event):
+            output.timer.mark("first_token")
+        else:
+            event_type = _EventRetention.event_type(event)
+            if event_type in _TokenUsage.EVENT_TYPES:
+                output.usage.observe(event)
+            elif event_type in _EventRetention.ERROR_TYPES:
+                output.errors.append(self._event_error_message(event))
+        if output.streaming:
+            self._publish_stream_event(self._stream_payload(event, output.message))
+
+        retained = self._event_retention.apply(event)
+        if retained is None:
+            return
+        if isinstance(output.events, list):
+            output.events.append(retained)
+        elif retained is event:
+            output.events.append_line(line)
+        else:
+            output.events.append_event(retained)
+
+    @staticmethod
+    def _write_prompt(stdin, source: _PromptSource) -> None:
+        """Feed a prompt to the child's stdin in chunks, then close it."""
+        try:
+            for chunk in source.iter_chunks():
+                stdin.write(chunk)
+            stdin.flush()
+        except (BrokenPipeError, OSError, ValueError):
+            # The child exited early; its exit status explains why
+            pass
+        finally:
+            try:
+                stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+
+    def _run_codex_process(self, cmd: list, env: dict, message: str,
+                           stdin_source: Optional[_PromptSource] = None,
+                           timer: Optional[_PhaseTimer] = None) -> tuple:
+        """
+        Run codex exec and parse its NDJSON stdout line by line as it arrives.
+
+        Args:
+            cmd: Command built by _build_command
+            env: Environment for the child process
+            message: Original prompt, echoed in stream payloads
+            stdin_source: Prompt to write to stdin when cmd reads it from "-"
+            timer: Phase timer receiving spawn, first byte/token and exit marks
+
+        Returns:
+            Tuple of (return code, parsed output dict, stderr text)
+        """
+        timer = timer or _PhaseTimer()
+        streaming = self.stream_events or self._stream_callback is not None
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if stdin_source is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            cwd=self.working_directory if os.path.isdir(self.working_directory) else None
+        )
+        timer.mark("spawned")
+        recording = None
+        if self._record_cassette is not None:
+            recording = _CassetteRecording(self._record_cassette, cmd, env, message, self.model)
+
+        # Drain stderr concurrently so a chatty child cannot block on a full pipe
+        stderr_chunks = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+
+        stdin_writer = None
+        if stdin_source is not None:
+            stdin_writer = threading.Thread(target=self._write_prompt,
+                                            args=(process.stdin, stdin_source), daemon=True)
+            stdin_writer.start()
+
+        timed_out = threading.Event()
+
+        def kill_on_timeout():
+            timed_out.set()
+            process.kill()
+
+        watchdog = threading.Timer(self.timeout, kill_on_timeout)
+        watchdog.daemon = True
+        watchdog.start()
+
+        parser = self._new_parser(streaming)
+        output = self._new_run_output(message, streaming, timer)
+        try:
+            # read1 returns as soon as any output is available, so events are handled as they land
+            for chunk in iter(lambda: process.stdout.read1(self.READ_CHUNK_SIZE), b""):
+                timer.mark("first_byte")
+                if recording is not None:
+                    recording.feed(chunk)
+                output.check_spill(parser.bytes_parsed + len(chunk))
+                for event, line in parser.feed(chunk):
+                    self._consume_event(event, line, output)
+            for event, line in parser.close():
+                self._consume_event(event, line, output)
+
+            process.wait()
+            timer.mark("exited")
+            _METRICS.inc("codex_bytes_parsed_total", parser.bytes_parsed, {"model": self.model or ""})
+        finally:
+            watchdog.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            stderr_reader.join()
+            if stdin_writer is not None:
+                stdin_writer.join()
+            process.stdout.close()
+            process.stderr.close()
+
+        stderr = b"".join(stderr_chunks).decode("utf-8", errors="replace")
+        if recording is not None:
+            recording.finish(None if timed_out.is_set() else process.returncode, stderr,
+                             timed_out=timed_out.is_set())
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, self.timeout)
+
+        return process.returncode, output.parsed(), stderr
+
+    @staticmethod
+    def _tag_result(result: dict, **fields) -> dict:
+        """Copy a response with extra fields, keeping compact results compact."""
+        if isinstance(result, CodexResult):
+            return result.with_fields(**fields)
+        return dict(result, **fields)
+
+    def _build_exec_result(self, return_code: int, parsed: dict, stderr: str, message: str) -> dict:
+        """Turn a finished codex exec run into the response dictionary."""
+        if return_code != 0:
+            BBLogger.log(f"Codex exec failed with code {return_code}: {stderr}")
+            result = {
+                "error": True,
+                "error_type": "execution_error",
+                "message": stderr or "Codex execution failed",
+                "return_code": return_code,
+                "original_message": message
+            }
+            # Tokens spent before the failure are still billed
+            if parsed["usage"]:
+                result["usage"] = self._usage_fields(parsed["usage"])
+            if parsed["errors"]:
+                result["error_events"] = parsed["errors"]
+            return result
+
+        if isinstance(parsed["events"], _EventBuffer):
+            buffer, offsets = parsed["events"].freeze()
+            fields = {
+                "success": True,
+                "response": parsed["assistant_message"],
+                "usage": self._usage_fields(parsed["usage"]),
+                "original_message": message
+            }
+            if isinstance(buffer, _MappedSpill):
+                # NDJSON of the retained events, served from the spill file
+                fields["raw_output"] = buffer
+                fields["spilled"] = True
+            if parsed["errors"]:
+                fields["error_events"] = parsed["errors"]
+            if self.lazy_results:
+                return CodexResult(fields, buffer, offsets, self._json_loads)
+            # Spilled without lazy results: still a plain dict, only the events stay on disk
+            return dict(fields, events=CodexLazyEvents(buffer, offsets, self._json_loads))
+
+        result = {
+            "success": True,
+            "response": parsed["assistant_message"],
+            "events": parsed["events"],
+            "usage": self._usage_fields(parsed["usage"]),
+            "original_message": message
+        }
+        # Codex retried through these, e.g. rate limits; they still signal pressure
+        if parsed["errors"]:
+            result["error_events"] = parsed["errors"]
+        return result
+
+    @staticmethod
+    def _prompt_source(message: Any) -> _PromptSource:
+        """
+        Work out where an incoming message's prompt comes from.
+
+        Dict messages may carry "content_path" (a file to stream) or
+        "content_stream" (an iterable of str/bytes chunks or a file object)
+        instead of inline "content"; file objects are accepted directly.
+        """
+        if isinstance(message, dict):
+            if "content" not in message:
+                if message.get("content_path"):
+                    return _PromptSource(path=message["content_path"])
+                if message.get("content_stream") is not None:
+                    return _PromptSource(stream=message["content_stream"])
+            message = message.get("content", str(message))
+        elif hasattr(message, "read"):
+            return _PromptSource(stream=message)
+        return _PromptSource(text=str(message))
+
+    @staticmethod
+    def _normalize_message(message: Any) -> str:
+        """Extract the prompt text (or a label for streamed prompts) from a message."""
+        return SubjectiveCodexDataSource._prompt_source(message).label
+
+    def _use_stdin(self, source: _PromptSource) -> bool:
+        """Decide whether the prompt goes over stdin instead of argv."""
+        if not source.inline:
+            return True
+        if self.prompt_via_stdin == "auto":
+            # Linux caps a single argv string at 128 KiB; stay clear of it for any UTF-8 width
+            return len(source.text) >= self.stdin_prompt_threshold
+        return bool(self.prompt_via_stdin)
+
+    def _cache_key(self, message: str) -> Optional[str]:
+        """
+        Fingerprint a prompt together with every option that changes its answer.
+
+        Returns:
+            Hex digest, or None when the invocation must not be cached
+        """
+        if not self.cache_enabled or self.sandbox_mode not in self.cacheable_sandbox_modes:
+            return None
+
+        # An answer about code is only valid while the code is unchanged
+        workspace = None
+        if self.cache_workspace_fingerprint and self.working_directory:
+            workspace = _WORKSPACE_FINGERPRINTS.fingerprint(
+                self.working_directory,
+                ttl=self.workspace_fingerprint_ttl,
+                max_files=self.workspace_fingerprint_max_files
+            )
+            if workspace is None:
+                return None
+
+        return self._invocation_key(message, workspace)
+
+    def _invocation_key(self, message: str, workspace: Optional[str] = None) -> str:
+        """Hash a prompt with every option that changes its answer."""
+        fingerprint = json.dumps([
+            message,
+            self.model,
+            self.sandbox_mode,
+            self.working_directory,
+            bool(self.full_auto),
+            bool(self.enable_search),
+            workspace,
+            # Holds config.toml, so tenants sharing a disk cache may get different answers
+            self.codex_home,
+            # Shapes the cached events, so instances sharing a disk cache must not mix them
+            self.params.get("event_retention")
+        ], sort_keys=True, default=str)
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def _coalesce_key(self, message: str, cache_key: Optional[str]) -> Optional[str]:
+        """Key under which identical in-flight prompts share one Codex run."""
+        if not self.coalesce_requests or self.sandbox_mode not in self.cacheable_sandbox_modes:
+            return None
+        return cache_key or self._invocation_key(message)
 
-        for path in common_paths:
-            if os.path.isfile(path):
-                self._codex_path = path
-                return path
+    def _cache_lookup(self, cache_key: Optional[str]) -> Optional[dict]:
+        """Return a cached response marked as such, or None on a miss."""
+        if cache_key is None:
+            return None
+        started = time.monotonic()
+        cached = self._response_cache.get(cache_key)
+        tier = "memory"
+        if cached is None and self._disk_cache is not None:
+            tier = "disk"
+            try:
+                cached = self._disk_cache.get(cache_key)
+            except (sqlite3.Error, zlib.error, ValueError) as e:
+                BBLogger.log(f"Error reading disk response cache: {e}")
+            if cached is not None:
+                # Promote so the next hit is served from memory
+                self._response_cache.put(cache_key, cached)
+        if cached is None:
+            _METRICS.inc("codex_cache_lookups_total", 1, {"result": "miss"})
+            return None
+        _METRICS.inc("codex_cache_lookups_total", 1, {"result": "hit", "tier": tier})
+        # The stored timings describe the original run, report the lookup instead
+        timings = {"total": time.monotonic() - started}
+        _METRICS.observe("codex_phase_seconds", timings["total"], {"phase": "cache_hit", "model": self.model or ""})
+        return self._tag_result(cached, cached=True, timings=timings)
 
-        return None
+    def _cache_store(self, cache_key: Optional[str], result: dict) -> None:
+        """Remember a successful response in every cache tier."""
+        if cache_key is None or not result.get("success") or result.get("spilled"):
+            return
+        self._response_cache.put(cache_key, result)
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.put(cache_key, result)
+            except sqlite3.Error as e:
+                BBLogger.log(f"Error writing disk response cache: {e}")
 
-    def _ensure_authenticated(self) -> bool:
-        """Ensure the Codex CLI is authenticated."""
-        if self._authenticated:
-            return True
+    def get_cache_stats(self) -> dict:
+        """
+        Return response cache counters.
 
-        codex_path = self._find_codex_cli()
-        if not codex_path:
-            BBLogger.log("Codex CLI not found. Please install it first.")
-            return False
+        Returns:
+            Dictionary with entries, bytes, hits, misses, evictions and
+            expirations, plus a "disk" entry when the SQLite tier is enabled
+        """
+        stats = self._response_cache.stats()
+        if self._disk_cache is not None:
+            stats["disk"] = self._disk_cache.stats()
+        return stats
 
-        if self.auth_method == "api_key" and self.api_key:
-            # API key auth - set environment variable
-            os.environ["OPENAI_API_KEY"] = self.api_key
-            self._authenticated = True
-            BBLogger.log("Using API key authentication for Codex CLI")
-            return True
+    def clear_cache(self) -> None:
+        """Drop every cached response."""
+        self._response_cache.clear()
+        if self._disk_cache is not None:
+            self._disk_cache.clear()
 
-        elif self.auth_method == "oauth":
-            # Trigger OAuth login; Codex will reuse an existing session if present.
-            BBLogger.log("OAuth authentication required. Triggering Codex login...")
-            return self._trigger_oauth_login()
+    def _process_message(self, message: Any) -> Any:
+        """
+        Process an incoming message using Codex CLI.
 
-        return False
+        Args:
+            message: The prompt/message to send to Codex
 
-    def _trigger_oauth_login(self) -> bool:
-        """Trigger the OAuth login flow for Codex CLI."""
-        codex_path = self._find_codex_cli()
-        if not codex_path:
-            return False
+        Returns:
+            Dictionary with response data
+        """
+        # Ensure we have string message (or a file/stream prompt source)
+        source = self._prompt_source(message)
+        message = source.label
 
-        try:
-            # Use device-auth for better compatibility
-            BBLogger.log("Starting Codex OAuth login (device auth)...")
-            result = subprocess.run(
-                [codex_path, "login", "--device-auth"],
-                capture_output=True,
-                text=True,
-                timeout=120  # 2 minutes for login
-            )
+        # Serve repeated prompts from the cache
+        cache_key = self._cache_key(message) if source.inline else None
+        cached = self._cache_lookup(cache_key)
+        if cached is not None:
+            return cached
 
-            if result.returncode == 0:
-                self._authenticated = True
-                output = (result.stdout or "").strip()
-                if result.stderr:
-                    output = "\n".join([output, result.stderr.strip()]).strip()
-                if output:
-                    BBLogger.log(f"Codex login output:\n{output}")
-                BBLogger.log("Codex OAuth login successful")
-                return True
-            else:
-                if result.stderr:
-                    BBLogger.log(f"Codex login error:\n{result.stderr.strip()}")
-                BBLogger.log("Codex OAuth login failed")
-                return False
+        def execute():
+            result = self._execute_message(message, source)
+            self._cache_store(cache_key, result)
+            return result
 
-        except subprocess.TimeoutExpired:
-            BBLogger.log("Codex OAuth login timed out")
-            return False
-        except Exception as e:
-            BBLogger.log(f"Error during Codex OAuth login: {e}")
-            return False
+        # Identical prompts already running share the first caller's result
+        coalesce_key = self._coalesce_key(message, cache_key) if source.inline else None
+        if coalesce_key is None:
+            return execute()
+        result, shared = self._single_flight.do(coalesce_key, execute)
+        return self._tag_result(result, coalesced=True) if shared else result
 
-    def _build_command(self, message: str) -> list:
-        """Build the codex exec command with all options."""
-        codex_path = self._find_codex_cli()
-        if not codex_path:
-            raise RuntimeError("Codex CLI not found")
+    def _record_metrics(self, result: dict, timer: _PhaseTimer) -> dict:
+        """Attach per-phase durations to a result and count its outcome."""
+        timer.mark("parsed")
+        durations = timer.durations()
+        model = self.model or ""
+        for phase, seconds in durations.items():
+            _METRICS.observe("codex_phase_seconds", seconds, {"phase": phase, "model": model})
+        outcome = result.get("error_type", "success") if result.get("error") else "success"
+        _METRICS.inc("codex_requests_total", 1, {"outcome": outcome, "model": model})
+        usage = result.get("usage")
+        if usage:
+            self._usage_ledger.record(model, _TokenUsage(**usage))
+            for field in _TokenUsage.FIELDS:
+                _METRICS.inc("codex_tokens_total", usage[field], {"kind": field, "model": model})
+        return self._tag_result(result, timings=durations)
 
-        cmd = [codex_path, "exec"]
+    def _usage_fields(self, usage: _TokenUsage) -> dict:
+        """The "usage" entry of a result, priced when token_prices covers the model."""
+        fields = usage.to_dict()
+        cost = usage.cost(self.token_prices.get(self.model))
+        if cost is not None:
+            fields["cost"] = cost
+        return fields
 
-        # Add JSON output for parsing
-        cmd.append("--json")
+    def get_usage_stats(self) -> dict:
+        """
+        Return token usage of this data source instance.
 
-        # Add model selection
-        if self.model:
-            cmd.extend(["--model", self.model])
+        Cache hits are not counted since they spend no tokens.
 
-        # Add sandbox mode
-        if self.sandbox_mode:
-            cmd.extend(["--sandbox", self.sandbox_mode])
+        Returns:
+            Dictionary with request count and token totals overall, per model
+            and over the last ``usage_window`` seconds
+        """
+        stats = self._usage_ledger.stats()
+        for scope in (stats, stats["window"]):
+            for model, usage in scope["by_model"].items():
+                cost = _TokenUsage(**usage).cost(self.token_prices.get(model))
+                if cost is not None:
+                    usage["cost"] = cost
+        return stats
 
-        # Add full-auto mode if enabled
-        if self.full_auto:
-            cmd.append("--full-auto")
+    def _collect_metrics(self) -> Iterator[tuple]:
+        """Gauge samples read at render time."""
+        scheduler = self._scheduler
+        if scheduler is not None:
+            yield "codex_queue_depth", {"model": self.model or ""}, scheduler.queue_depth()
+        if self._limiter is not None:
+            yield "codex_concurrency_limit", {"model": self.model or ""}, int(self._limiter.limit)
+        for key in self.get_api_key_stats():
+            yield "codex_api_key_in_flight", {"key": key["key_id"]}, key["in_flight"]
 
-        # Add search if enabled
-        if self.enable_search:
-            cmd.append("--search")
+    def get_metrics(self) -> str:
+        """
+        Return all Codex metrics of this process in Prometheus text format.
 
-        # Add working directory
-        if self.working_directory:
-            cmd.extend(["--cd", self.working_directory])
+        Returns:
+            Text exposition, the same body served on ``metrics_port``
+        """
+        return _METRICS.render()
 
-        # Add the prompt
-        cmd.append(message)
+    def get_latency_stats(self) -> list:
+        """
+        Return the process-wide per-phase latency histograms.
 
-        return cmd
+        Returns:
+            List of dicts with name, labels (phase, model), buckets, sum and count
+        """
+        return [h for h in _METRICS.histogram_snapshots() if h["name"] == "codex_phase_seconds"]
 
-    def _parse_json_output(self, output: str) -> dict:
-        """Parse the newline-delimited JSON output from codex exec."""
-        events = []
-        assistant_message = ""
+    def _uses_pool(self, source: _PromptSource) -> bool:
+        # Pooled workers take the prompt inside a JSON-RPC frame, so streamed prompts use exec;
+        # recording needs the exec stream as well
+        return self.pool_size > 0 and source.inline and self._record_cassette is None
 
-        for line in output.strip().split("\n"):
-            if not line:
-                continue
-            try:
-                event = json.loads(line)
-                events.append(event)
+    def _lease_key(self, source: _PromptSource) -> Optional[int]:
+        """Pick an API key for an exec run; pooled workers and replays bring their own."""
+        if self._api_keys is None or self._replay_cassette is not None or self._uses_pool(source):
+            return None
+        return self._api_keys.acquire()
 
-                # Extract assistant message from events
-                if event.get("type") == "message" and event.get("role") == "assistant":
-                    content = event.get("content", [])
-                    for item in content:
-                        if item.get("type") == "text":
-                            assistant_message += item.get("text", "")
+    def _release_key(self, key_index: Optional[int], result: Optional[dict]) -> Optional[dict]:
+        """Return a leased key, cooling it down if the run hit a rate limit."""
+        if key_index is None:
+            return result
+        rate_limited = result is not None and self._is_rate_limited(result)
+        self._api_keys.release(key_index, rate_limited)
+        key_id = self._api_keys.ids[key_index]
+        if rate_limited:
+            BBLogger.log(f"Codex API key {key_id} hit a rate limit, cooling it down")
+            _METRICS.inc("codex_rate_limited_total", 1, {"key": key_id})
+        return None if result is None else self._tag_result(result, api_key_id=key_id)
 
-            except json.JSONDecodeError:
-                # Non-JSON line, might be status output
-                continue
+    def _release_limiter(self, started_at: Optional[float], result: Optional[dict]) -> None:
+        """Feed a finished run's outcome back into the adaptive concurrency limit."""
+        if self._limiter is None:
+            return
+        if result is None:
+            # Cancelled or crashed; says nothing about capacity
+            self._limiter.release(started_at, None)
+            return
+        failure = self._classify_failure(result)
+        if failure in ("rate_limited", "overloaded"):
+            _METRICS.inc("codex_overload_signals_total", 1, {"kind": failure, "model": self.model or ""})
+            self._limiter.release(started_at, "overload")
+        elif result.get("success"):
+            self._limiter.release(started_at, "success")
+        else:
+            self._limiter.release(started_at, None)
 
-        return {
-            "events": events,
-            "assistant_message": assistant_message,
-            "raw_output": output
-        }
+    def get_concurrency_stats(self) -> dict:
+        """
+        Return the adaptive concurrency limiter state.
 
-    def _process_message(self, message: Any) -> Any:
+        Returns:
+            Dictionary with the current limit, in-flight runs and bounds,
+            or an empty dict when adaptive_concurrency is off
         """
-        Process an incoming message using Codex CLI.
+        return self._limiter.stats() if self._limiter is not None else {}
 
-        Args:
-            message: The prompt/message to send to Codex
+    def get_api_key_stats(self) -> list:
+        """
+        Return per-key load for the API key pool.
 
         Returns:
-            Dictionary with response data
+            List of dicts with key_id (a hash, never the key), in_flight,
+            cooldown_remaining and rate_limited count; empty without a pool
         """
-        # Ensure we have string message
-        if isinstance(message, dict):
-            message = message.get("content", str(message))
-        message = str(message)
+        return self._api_keys.stats() if self._api_keys else []
+
+    def _execute_message(self, message: str, source: Optional[_PromptSource] = None) -> dict:
+        """Run a normalized prompt through Codex CLI, bypassing the cache."""
+        source = source or _PromptSource(text=message)
+        timer = _PhaseTimer()
+        labels = {"model": self.model or ""}
+        started_at = self._limiter.acquire() if self._limiter is not None else None
+        key_index = self._lease_key(source)
+        result = None
+        _METRICS.add_gauge("codex_in_flight", 1, labels)
+        try:
+            result = self._execute_timed(message, source, timer, key_index)
+        finally:
+            _METRICS.add_gauge("codex_in_flight", -1, labels)
+            result = self._release_key(key_index, result)
+            self._release_limiter(started_at, result)
+        self._check_auth_failure(result)
+        return self._record_metrics(result, timer)
+
+    def _execute_timed(self, message: str, source: _PromptSource, timer: _PhaseTimer,
+                       key_index: Optional[int] = None) -> dict:
+        """Body of _execute_message, marking each phase on ``timer``."""
+        if self._replay_cassette is not None:
+            steps = self._replay_steps(message, timer)
+            try:
+                while True:
+                    time.sleep(next(steps))
+            except StopIteration as done:
+                return done.value
 
         # Ensure authentication
-        if not self._ensure_authenticated():
-            return {
-                "error": True,
-                "error_type": "authentication_error",
-                "message": "Failed to authenticate with Codex CLI. Please check your credentials.",
-                "original_message": message
-            }
+        auth_state = self._auth_status()
+        timer.mark("authenticated")
+        if auth_state != _LoginFlow.AUTHENTICATED:
+            return self._auth_error(auth_state, message)
+
+        if self._uses_pool(source):
+            return self._process_via_pool(message, timer)
 
         try:
             # Build and execute command
-            cmd = self._build_command(message)
+            use_stdin = self._use_stdin(source)
+            cmd = self._build_command(None if use_stdin else source.text)
             BBLogger.log(f"Executing Codex command: {' '.join(cmd[:3])}...")
 
             # Set up environment
-            env = os.environ.copy()
-            if self.auth_method == "api_key" and self.api_key:
-                env["OPENAI_API_KEY"] = self.api_key
+            env = self._env_for(key_index)
+            timer.mark("built")
 
-            # Execute codex
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=self.timeout,
-                env=env,
-                cwd=self.working_directory if os.path.isdir(self.working_directory) else None
+            # Execute codex, parsing events as they are emitted
+            return_code, parsed, stderr = self._run_codex_process(
+                cmd, env, message, stdin_source=source if use_stdin else None, timer=timer
             )
-
-            if result.returncode != 0:
-                BBLogger.log(f"Codex exec failed with code {result.returncode}: {result.stderr}")
-                return {
-                    "error": True,
-                    "error_type": "execution_error",
-                    "message": result.stderr or "Codex execution failed",
-                    "return_code": result.returncode,
-                    "original_message": message
-                }
-
-            # Parse the JSON output
-            parsed = self._parse_json_output(result.stdout)
-
-            return {
-                "success": True,
-                "response": parsed["assistant_message"],
-                "events": parsed["events"],
-                "original_message": message
-            }
+            return self._build_exec_result(return_code, parsed, stderr, message)
 
         except subprocess.TimeoutExpired:
             BBLogger.log(f"Codex command timed out after {self.timeout} seconds")
@@ -278,6 +3652,375 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
                 "original_message": message
             }
 
+    def _replay_steps(self, message: str, timer: _PhaseTimer):
+        """
+        Replay a recorded run through the normal parsing path.
+
+        Generator yielding the seconds to sleep before the next recorded line
+        is due (scaled by ``replay_speed``), so the sync and async paths can
+        each wait their own way. Returns the response dictionary.
+        """
+        record = self._replay_cassette.select(message)
+        timer.mark("authenticated")
+        timer.mark("built")
+        if record is None:
+            return {
+                "error": True,
+                "error_type": "exception",
+                "message": f"Replay cassette {self._replay_cassette.path} has no recorded runs",
+                "original_message": message
+            }
+
+        started = time.monotonic()
+        timer.mark("spawned")
+
+        def pause(offset: float) -> float:
+            if self.replay_speed <= 0:
+                return 0
+            return max(started + offset / self.replay_speed - time.monotonic(), 0)
+
+        streaming = self.stream_events or self._stream_callback is not None
+        parser = self._new_parser(streaming)
+        output = self._new_run_output(message, streaming, timer)
+        for offset, line in record["events"]:
+            delay = pause(offset)
+            if delay:
+                yield delay
+            timer.mark("first_byte")
+            for event, raw in parser.feed(line.encode("utf-8") + b"\n"):
+                self._consume_event(event, raw, output)
+        for event, raw in parser.close():
+            self._consume_event(event, raw, output)
+
+        delay = pause(record.get("duration", 0))
+        if delay:
+            yield delay
+        timer.mark("exited")
+
+        if record.get("timed_out"):
+            return {
+                "error": True,
+                "error_type": "timeout",
+                "message": f"Recorded Codex run timed out after {record.get('duration', 0):.1f} seconds",
+                "original_message": message,
+                "replayed": True
+            }
+        result = self._build_exec_result(record["return_code"], output.parsed(), record.get("stderr", ""), message)
+        return self._tag_result(result, replayed=True)
+
+    def _get_async_semaphore(self) -> asyncio.Semaphore:
+        """Return the concurrency semaphore bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_semaphore is None or self._async_semaphore_loop is not loop:
+            self._async_semaphore = asyncio.Semaphore(self.async_concurrency)
+            self._async_semaphore_loop = loop
+        return self._async_semaphore
+
+    @staticmethod
+    async def _awrite_prompt(stdin, source: _PromptSource) -> None:
+        """
+        Async counterpart of _write_prompt.
+
+        File and stream prompts block on ``read()``, so their chunks are read
+        on the default executor instead of the event loop shared by every job.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = source.iter_chunks()
+        try:
+            while True:
+                if source.inline:
+                    chunk = next(chunks, None)
+                else:
+                    chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                stdin.write(chunk)
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # Cancelled while the executor was still reading; the generator ends with that read
+                pass
+            stdin.close()
+
+    async def _aread_process(self, process, message: str, streaming: bool,
+                             stdin_source: Optional[_PromptSource] = None,
+                             timer: Optional[_PhaseTimer] = None,
+                             recording: Optional[_CassetteRecording] = None) -> tuple:
+        """Read an asyncio child's stdout in chunks until it exits."""
+        stderr_task = asyncio.ensure_future(process.stderr.read())
+        stdin_task = None
+        if stdin_source is not None:
+            stdin_task = asyncio.ensure_future(self._awrite_prompt(process.stdin, stdin_source))
+        parser = self._new_parser(streaming)
+        timer = timer or _PhaseTimer()
+        output = self._new_run_output(message, streaming, timer)
+        try:
+            while True:
+                chunk = await process.stdout.read(self.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                timer.mark("first_byte")
+                if recording is not None:
+                    recording.feed(chunk)
+                output.check_spill(parser.bytes_parsed + len(chunk))
+                for event, line in parser.feed(chunk):
+                    self._consume_event(event, line, output)
+            for event, line in parser.close():
+                self._consume_event(event, line, output)
+            return_code = await process.wait()
+            timer.mark("exited")
+            _METRICS.inc("codex_bytes_parsed_total", parser.bytes_parsed, {"model": self.model or ""})
+            stderr = (await stderr_task).decode("utf-8", errors="replace")
+            if stdin_task is not None:
+                await stdin_task
+            if recording is not None:
+                recording.finish(return_code, stderr)
+        finally:
+            for task in (stderr_task, stdin_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+        return return_code, output.parsed(), stderr
+
+    async def aprocess_message(self, message: Any) -> dict:
+        """
+        Process a message with Codex CLI without blocking the event loop.
+
+        At most ``async_concurrency`` Codex processes run at once per event
+        loop. Cancelling the awaiting task kills the child process.
+
+        Args:
+            message: The prompt/message to send to Codex
+
+        Returns:
+            Dictionary with response data, same shape as _process_message
+        """
+        source = self._prompt_source(message)
+        message = source.label
+
+        cache_key = self._cache_key(message) if source.inline else None
+        cached = self._cache_lookup(cache_key)
+        if cached is not None:
+            return cached
+
+        async def execute():
+            result = await self._aexecute_message(message, source)
+            self._cache_store(cache_key, result)
+            return result
+
+        coalesce_key = self._coalesce_key(message, cache_key) if source.inline else None
+        if coalesce_key is None:
+            return await execute()
+        result, shared = await self._single_flight.ado(coalesce_key, execute)
+        return self._tag_result(result, coalesced=True) if shared else result
+
+    async def _aexecute_message(self, message: str, source: Optional[_PromptSource] = None) -> dict:
+        """Async counterpart of _execute_message."""
+        source = source or _PromptSource(text=message)
+        timer = _PhaseTimer()
+        labels = {"model": self.model or ""}
+        started_at = await self._limiter.aacquire() if self._limiter is not None else None
+        key_index = self._lease_key(source)
+        result = None
+        _METRICS.add_gauge("codex_in_flight", 1, labels)
+        try:
+            result = await self._aexecute_timed(message, source, timer, key_index)
+        finally:
+            _METRICS.add_gauge("codex_in_flight", -1, labels)
+            result = self._release_key(key_index, result)
+            self._release_limiter(started_at, result)
+        self._check_auth_failure(result)
+        return self._record_metrics(result, timer)
+
+    async def _aexecute_timed(self, message: str, source: _PromptSource, timer: _PhaseTimer,
+                              key_index: Optional[int] = None) -> dict:
+        """Async counterpart of _execute_timed."""
+        if self._replay_cassette is not None:
+            steps = self._replay_steps(message, timer)
+            try:
+                while True:
+                    await asyncio.sleep(next(steps))
+            except StopIteration as done:
+                return done.value
+
+        loop = asyncio.get_running_loop()
+
+        # Waiting for a login may take minutes, keep it off the event loop
+        auth_state = _LoginFlow.AUTHENTICATED if self._authenticated else \
+            await loop.run_in_executor(None, self._auth_status)
+        timer.mark("authenticated")
+        if auth_state != _LoginFlow.AUTHENTICATED:
+            return self._auth_error(auth_state, message)
+
+        async with self._get_async_semaphore():
+            if self._uses_pool(source):
+                return await loop.run_in_executor(None, self._process_via_pool, message, timer)
+
+            process = None
+            recording = None
+            try:
+                use_stdin = self._use_stdin(source)
+                cmd = self._build_command(None if use_stdin else source.text)
+                BBLogger.log(f"Executing Codex command (async): {' '.join(cmd[:3])}...")
+                env = self._env_for(key_index)
+                timer.mark("built")
+
+                process = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.PIPE if use_stdin else None,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=env,
+                    cwd=self.working_directory if os.path.isdir(self.working_directory) else None
+                )
+                timer.mark("spawned")
+                if self._record_cassette is not None:
+                    recording = _CassetteRecording(self._record_cassette, cmd, env, message, self.model)
+                streaming = self.stream_events or self._stream_callback is not None
+                return_code, parsed, stderr = await asyncio.wait_for(
+                    self._aread_process(process, message, streaming,
+                                        stdin_source=source if use_stdin else None, timer=timer,
+                                        recording=recording),
+                    timeout=self.timeout
+                )
+                return self._build_exec_result(return_code, parsed, stderr, message)
+
+            except asyncio.TimeoutError:
+                BBLogger.log(f"Codex command timed out after {self.timeout} seconds")
+                if recording is not None:
+                    recording.finish(None, "", timed_out=True)
+                return {
+                    "error": True,
+                    "error_type": "timeout",
+                    "message": f"Codex execution timed out after {self.timeout} seconds",
+                    "original_message": message
+                }
+            except asyncio.CancelledError:
+                BBLogger.log("Codex command cancelled")
+                raise
+            except Exception as e:
+                BBLogger.log(f"Error executing Codex command: {e}")
+                return {
+                    "error": True,
+                    "error_type": "exception",
+                    "message": str(e),
+                    "original_message": message
+                }
+            finally:
+                if process is not None and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+    async def asend_message(self, message: Any,
+                            callback: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        Async counterpart of send_message.
+
+        Args:
+            message: The prompt/message to send to Codex
+            callback: Optional callable invoked with the response
+
+        Returns:
+            Dictionary with response data
+        """
+        response = await self.aprocess_message(message)
+        if callback:
+            try:
+                callback(response)
+            except Exception as e:
+                BBLogger.log(f"Error in Codex async response callback: {e}")
+        return response
+
+    def schedule_message(self, message: Any, priority: Any = None, deadline: Optional[float] = None,
+                         callback: Optional[Callable[[dict], None]] = None) -> Future:
+        """
+        Queue a message for background processing by priority and deadline.
+
+        Within a priority class requests run earliest-deadline-first; a
+        request whose deadline passes before it starts is answered with a
+        "deadline_exceeded" error instead of running Codex. Dict messages
+        may carry "priority" and "deadline" keys used when the arguments
+        are omitted.
+
+        Args:
+            message: The prompt/message to send to Codex
+            priority: "interactive", "default", "batch" or an int (lower runs first)
+            deadline: Absolute time.time() timestamp after which the answer is useless
+            callback: Optional callable invoked with the response
+
+        Returns:
+            Future resolved with the response dictionary
+        """
+        if isinstance(message, dict):
+            if priority is None:
+                priority = message.get("priority")
+            if deadline is None:
+                deadline = message.get("deadline")
+        priority = _RequestScheduler.priority_value("default" if priority is None else priority)
+
+        # Convert the wall-clock deadline so clock adjustments cannot reorder work
+        monotonic_deadline = None
+        if deadline is not None:
+            monotonic_deadline = time.monotonic() + (float(deadline) - time.time())
+
+        with self._scheduler_lock:
+            if self._scheduler is None:
+                self._scheduler = _RequestScheduler(self._process_message, self.scheduler_workers)
+            scheduler = self._scheduler
+        return scheduler.submit(message, priority, monotonic_deadline, callback)
+
+    def process_batch(self, messages: Iterable[Any],
+                      max_concurrency: Optional[int] = None) -> Iterator[Tuple[int, dict]]:
+        """
+        Process many messages concurrently, yielding results as they complete.
+
+        Messages are pulled from ``messages`` lazily, so at most
+        ``max_concurrency`` prompts are in flight and large inputs are never
+        materialized up front. Closing the iterator early cancels every
+        message that has not started yet.
+
+        Args:
+            messages: Iterable of prompts/messages to send to Codex
+            max_concurrency: Maximum concurrent Codex runs (defaults to the
+                ``batch_concurrency`` param)
+
+        Yields:
+            Tuples of (index of the original message, response dictionary)
+            in completion order
+        """
+        max_concurrency = max(1, int(max_concurrency or self.batch_concurrency))
+        pending_messages = enumerate(messages)
+        in_flight = {}
+
+        executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="codex-batch")
+        try:
+            def submit(count):
+                for index, message in itertools.islice(pending_messages, count):
+                    in_flight[executor.submit(self._process_message, message)] = (index, message)
+
+            submit(max_concurrency)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, message = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {
+                            "error": True,
+                            "error_type": "exception",
+                            "message": str(e),
+                            "original_message": self._normalize_message(message)
+                        }
+                    yield index, result
+                submit(max_concurrency - len(in_flight))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def check_codex_installation(self) -> dict:
         """
         Check if Codex CLI is installed and return status information.
@@ -293,26 +4036,8 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
                 "message": "Codex CLI not found. Please install from https://developers.openai.com/codex/cli/"
             }
 
-        try:
-            result = subprocess.run(
-                [codex_path, "--version"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-
-            return {
-                "installed": True,
-                "path": codex_path,
-                "version": result.stdout.strip() if result.returncode == 0 else "unknown"
-            }
-        except Exception as e:
-            return {
-                "installed": True,
-                "path": codex_path,
-                "version": "unknown",
-                "error": str(e)
-            }
+        # Only probes --version again when the binary itself changed
+        return dict({"installed": True, "path": codex_path}, **_CODEX_BINARIES.version(codex_path))
 
     def get_icon(self) -> str:
         """Return the SVG icon for Codex data source."""
@@ -350,6 +4075,19 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
                         {"value": "oauth", "label": "OAuth (Browser Login)"}
                     ]
                 },
+                {
+                    "name": "auth_wait",
+                    "type": "select",
+                    "label": "While Login Is Pending",
+                    "required": False,
+                    "default": "queue",
+                    "description": "Hold requests until the background OAuth login finishes, or fail them right away",
+                    "options": [
+                        {"value": "queue", "label": "Queue Requests"},
+                        {"value": "fail_fast", "label": "Fail Fast"}
+                    ],
+                    "depends_on": {"field": "auth_method", "value": "oauth"}
+                },
                 {
                     "name": "api_key",
                     "type": "password",
@@ -412,6 +4150,67 @@ class SubjectiveCodexDataSource(SubjectiveOnDemandDataSource):
                     "required": False,
                     "default": False,
                     "description": "Allow Codex to search the web"
+                },
+                {
+                    "name": "stream_events",
+                    "type": "checkbox",
+                    "label": "Stream Partial Output",
+                    "required": False,
+                    "default": False,
+                    "description": "Push assistant text and tool events to subscribers while Codex is still running"
+                },
+                {
+                    "name": "cache_enabled",
+                    "type": "checkbox",
+                    "label": "Cache Responses",
+                    "required": False,
+                    "default": False,
+                    "description": "Answer repeated read-only prompts from an in-memory cache"
+                },
+                {
+                    "name": "cache_ttl",
+                    "type": "number",
+                    "label": "Cache TTL (seconds)",
+                    "required": False,
+                    "default": 3600,
+                    "description": "How long a cached response stays valid"
+                },
+                {
+                    "name": "pool_size",
+                    "type": "number",
+                    "label": "Warm Worker Pool Size",
+                    "required": False,
+                    "default": 0,
+                    "description": "Number of long-lived Codex processes to keep warm (0 spawns one process per message)"
+                },
+                {
+                    "name": "adaptive_concurrency",
+                    "type": "checkbox",
+                    "label": "Adaptive Concurrency",
+                    "required": False,
+                    "default": False,
+                    "description": "Grow parallel Codex runs while they succeed and cut them back on rate limits or overload"
+                },
+                {
+                    "name": "codex_home",
+                    "type": "text",
+                    "label": "Codex Home Directory",
+                    "required": False,
+                    "description": "Separate CODEX_HOME (config and login session) for this data source; leave empty to use ~/.codex"
+                },
+                {
+                    "name": "codex_path",
+                    "type": "text",
+                    "label": "Codex CLI Path",
+                    "required": False,
+                    "description": "Path to the codex executable (leave empty to search PATH)"
+                },
+                {
+                    "name": "metrics_port",
+                    "type": "number",
+                    "label": "Metrics Port",
+                    "required": False,
+                    "description": "Serve Prometheus metrics over HTTP on this local port (leave empty to disable)"
                 }
             ]
         }
@@ -0,0 +1,197 @@
+"""
+Micro-benchmarks for SubjectiveCodexDataSource overhead, run against the
+fake Codex CLI in tests/fake_codex.py so no API key or network is needed.
+
+Usage:
+    python tests/benchmark_codex_datasource.py                     # compare with the baseline
+    python tests/benchmark_codex_datasource.py --update-baseline   # record a new baseline
+
+Measures:
+    - process_overhead_ms: median time a _process_message call spends outside
+      the fake CLI's lifetime (its "total" minus "run" phase timings), i.e.
+      what the connector itself adds around the process
+    - parser_mb_per_s: NDJSON parser throughput on a synthetic event stream
+    - request_peak_kib: peak Python allocations while handling one request
+      with large events
+
+Exits with status 1 when a metric is worse than the baseline by more than
+the tolerance (default 50%, these numbers are noisy across machines).
+
+The JSON backend is pinned (--json-backend, default the stdlib "json") and
+stored in the baseline, since orjson parses several times faster and is
+an optional dependency; a baseline is only compared with runs on the same
+backend.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from SubjectiveCodexDataSource import SubjectiveCodexDataSource, _NDJSONParser, _json_loads_for, orjson
+
+FAKE_CODEX = os.path.join(TESTS_DIR, "fake_codex.py")
+BASELINE_PATH = os.path.join(TESTS_DIR, "benchmark_baseline.json")
+
+# Metric name -> True if larger values are better
+HIGHER_IS_BETTER = {
+    "process_overhead_ms": False,
+    "parser_mb_per_s": True,
+    "request_peak_kib": False,
+}
+
+# Absolute slack on top of the relative tolerance, for metrics that sit near zero
+SLACK = {
+    "process_overhead_ms": 2.0,
+}
+
+
+def _datasource(backend: str, **params) -> SubjectiveCodexDataSource:
+    return SubjectiveCodexDataSource(
+        name="benchmark_codex",
+        params=dict({
+            "json_backend": backend,
+            "async_mode": False,
+            "auth_method": "api_key",
+            "api_key": "sk-benchmark",
+            "codex_path": FAKE_CODEX,
+            "coalesce_requests": False
+        }, **params)
+    )
+
+
+def bench_process_overhead(iterations: int, backend: str) -> float:
+    datasource = _datasource(backend)
+    datasource._process_message("warm up")
+
+    overheads = []
+    for _ in range(iterations):
+        result = datasource._process_message("benchmark prompt")
+        assert result.get("success"), result
+        # Everything outside the child's lifetime: auth, command building, spawn and result building
+        timings = result["timings"]
+        overheads.append(timings["total"] - timings["run"])
+
+    datasource.stop()
+    return statistics.median(overheads) * 1000
+
+
+def bench_parser(total_mb: int, backend: str) -> float:
+    line = json.dumps({
+        "type": "exec_command_end",
+        "call_id": "call_0",
+        "exit_code": 0,
+        "stdout": "x" * 900
+    }).encode("utf-8") + b"\n"
+    chunk = line * max(1, (64 * 1024) // len(line))
+    chunks = max(1, (total_mb * 1024 * 1024) // len(chunk))
+
+    parser = _NDJSONParser(_json_loads_for(backend))
+    started = time.perf_counter()
+    for _ in range(chunks):
+        for _ in parser.feed(chunk):
+            pass
+    for _ in parser.close():
+        pass
+    elapsed = time.perf_counter() - started
+    return parser.bytes_parsed / (1024 * 1024) / elapsed
+
+
+def bench_request_memory(backend: str) -> float:
+    os.environ["FAKE_CODEX_EVENTS"] = "200"
+    os.environ["FAKE_CODEX_EVENT_BYTES"] = "4096"
+    try:
+        datasource = _datasource(backend, lazy_results=True)
+        datasource._process_message("warm up")
+        tracemalloc.start()
+        result = datasource._process_message("benchmark prompt")
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert result.get("success"), result
+        datasource.stop()
+    finally:
+        del os.environ["FAKE_CODEX_EVENTS"]
+        del os.environ["FAKE_CODEX_EVENT_BYTES"]
+    return peak / 1024
+
+
+def run_benchmarks(iterations: int, backend: str) -> dict:
+    return {
+        "process_overhead_ms": bench_process_overhead(iterations, backend),
+        "parser_mb_per_s": bench_parser(64, backend),
+        "request_peak_kib": bench_request_memory(backend),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return a description of every metric that regressed past the tolerance."""
+    regressions = []
+    for name, value in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        slack = SLACK.get(name, 0)
+        if HIGHER_IS_BETTER[name]:
+            regressed = value < expected * (1 - tolerance) - slack
+        else:
+            regressed = value > expected * (1 + tolerance) + slack
+        if regressed:
+            regressions.append(f"{name}: {value:.2f} (baseline {expected:.2f})")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json-backend", choices=("json", "orjson"), default="json")
+    args = parser.parse_args()
+
+    if args.json_backend == "orjson" and orjson is None:
+        print("orjson is not installed")
+        return 2
+    print(f"{'json_backend':24} {args.json_backend:>10}")
+    results = run_benchmarks(args.iterations, args.json_backend)
+    for name, value in results.items():
+        print(f"{name:24} {value:10.2f}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            baseline = {"json_backend": args.json_backend}
+            baseline.update((name, round(value, 2)) for name, value in results.items())
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline first")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    baseline_backend = baseline.get("json_backend", "json")
+    if baseline_backend != args.json_backend:
+        print(f"\nBaseline was recorded with the {baseline_backend} backend, "
+              f"run with --json-backend {baseline_backend} to compare")
+        return 2
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the Codex CLI, for offline tests and benchmarks.
+
+Point the data source at it with the "codex_path" param:
+
+    SubjectiveCodexDataSource(params={"codex_path": "tests/fake_codex.py", ...})
+
+Supports "--version", "login" (and "login status"), "exec --json" (prompt
+from argv or "-" for stdin) and "mcp-server". Output is controlled through
+environment variables:
+
+    FAKE_CODEX_EVENTS         Tool events emitted before the reply (default 3)
+    FAKE_CODEX_EVENT_BYTES    Padding added to each tool event (default 0)
+    FAKE_CODEX_DELAY          Seconds to sleep between events (default 0)
+    FAKE_CODEX_STARTUP_DELAY  Seconds to sleep before the first event (default 0)
+    FAKE_CODEX_EXIT_CODE      Exit code of "exec" (default 0)
+    FAKE_CODEX_STDERR_BYTES   Bytes of noise written to stderr (default 0)
+    FAKE_CODEX_RESPONSE       Assistant reply (default "echo: <prompt>")
+    FAKE_CODEX_USAGE          Emit a turn.completed usage event when "1" (default "1")
+    FAKE_CODEX_PID_FILE       "exec" writes its process id to this file when set
+    FAKE_CODEX_SLOW_PROMPT    Prompts containing this text sleep FAKE_CODEX_SLOW_DELAY
+                              seconds (default 1) before the first event
+    FAKE_CODEX_RATE_LIMIT_KEY "exec" fails with a 429 error when OPENAI_API_KEY equals this
+    FAKE_CODEX_LOGIN_FILE     Simulated OAuth session: "login" creates this file, "login
+                              status" fails and "exec" is rejected with a 401 while it is
+                              missing (default: always logged in)
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _events(prompt: str):
+    """The configured event stream for one prompt, reply last."""
+    padding = "x" * _env_int("FAKE_CODEX_EVENT_BYTES", 0)
+    delay = _env_float("FAKE_CODEX_DELAY", 0)
+    time.sleep(_env_float("FAKE_CODEX_STARTUP_DELAY", 0))
+    slow_prompt = os.environ.get("FAKE_CODEX_SLOW_PROMPT")
+    if slow_prompt and slow_prompt in prompt:
+        time.sleep(_env_float("FAKE_CODEX_SLOW_DELAY", 1))
+
+    for index in range(_env_int("FAKE_CODEX_EVENTS", 3)):
+        yield {
+            "type": "exec_command_end",
+            "call_id": f"call_{index}",
+            "exit_code": 0,
+            "duration": 0.01,
+            "stdout": padding
+        }
+        if delay:
+            time.sleep(delay)
+
+    reply = os.environ.get("FAKE_CODEX_RESPONSE", f"echo: {prompt}")
+    yield {"type": "agent_message_delta", "delta": reply}
+    yield {"type": "message", "role": "assistant", "content": [{"type": "text", "text": reply}]}
+    if os.environ.get("FAKE_CODEX_USAGE", "1") == "1":
+        yield {
+            "type": "turn.completed",
+            "usage": {"input_tokens": len(prompt), "cached_input_tokens": 0, "output_tokens": len(reply)}
+        }
+
+
+def _write_stderr_noise() -> None:
+    remaining = _env_int("FAKE_CODEX_STDERR_BYTES", 0)
+    while remaining > 0:
+        line = "fake codex: warning\n"[:remaining]
+        sys.stderr.write(line)
+        remaining -= len(line)
+    sys.stderr.flush()
+
+
+def _logged_in() -> bool:
+    login_file = os.environ.get("FAKE_CODEX_LOGIN_FILE")
+    return not login_file or os.path.exists(login_file)
+
+
+def run_login(args: list) -> int:
+    login_file = os.environ.get("FAKE_CODEX_LOGIN_FILE")
+    if args[:1] == ["status"]:
+        if not _logged_in():
+            print("Not logged in")
+            return 1
+    elif login_file:
+        print("Open https://example.invalid/device and enter code FAKE-1234")
+        with open(login_file, "w", encoding="utf-8") as f:
+            f.write("session\n")
+    print("Logged in using an API key")
+    return 0
+
+
+def run_exec(args: list) -> int:
+    prompt = args[-1] if args else "-"
+    if prompt == "-":
+        prompt = sys.stdin.read()
+
+    if not _logged_in():
+        sys.stderr.write("Error: 401 Unauthorized: session expired, run codex login\n")
+        return 1
+
+    rate_limited_key = os.environ.get("FAKE_CODEX_RATE_LIMIT_KEY")
+    if rate_limited_key and os.environ.get("OPENAI_API_KEY") == rate_limited_key:
+        sys.stderr.write("ERROR: unexpected status 429 Too Many Requests: rate limit reached\n")
+        return 1
+
+    pid_file = os.environ.get("FAKE_CODEX_PID_FILE")
+    if pid_file:
+        with open(pid_file, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+
+    _write_stderr_noise()
+    out = sys.stdout
+    for event in _events(prompt):
+        out.write(json.dumps(event) + "\n")
+        out.flush()
+    return _env_int("FAKE_CODEX_EXIT_CODE", 0)
+
+
+def run_mcp_server() -> int:
+    def send(frame):
+        sys.stdout.write(json.dumps(frame) + "\n")
+        sys.stdout.flush()
+
+    for line in sys.stdin:
+        try:
+            frame = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if "id" not in frame or "method" not in frame:
+            continue
+
+        if frame["method"] != "tools/call":
+            # initialize, ping and anything else succeed with an empty result
+            send({"jsonrpc": "2.0", "id": frame["id"], "result": {}})
+            continue
+
+        prompt = frame.get("params", {}).get("arguments", {}).get("prompt", "")
+        reply = ""
+        for event in _events(prompt):
+            if event["type"] == "message":
+                reply = event["content"][0]["text"]
+                event = {"type": "agent_message", "message": reply}
+            send({"jsonrpc": "2.0", "method": "codex/event", "params": {"msg": event}})
+        send({
+            "jsonrpc": "2.0",
+            "id": frame["id"],
+            "result": {
+                "content": [{"type": "text", "text": reply}],
+                "isError": _env_int("FAKE_CODEX_EXIT_CODE", 0) != 0
+            }
+        })
+    return 0
+
+
+def main(argv: list) -> int:
+    if not argv or argv[0] in ("--version", "-V"):
+        print("codex-cli 0.0.0-fake")
+        return 0
+    if argv[0] == "login":
+        return run_login(argv[1:])
+    if argv[0] == "exec":
+        return run_exec(argv[1:])
+    if argv[0] == "mcp-server":
+        return run_mcp_server()
+    sys.stderr.write(f"fake codex: unsupported command {argv[0]}\n")
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
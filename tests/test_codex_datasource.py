@@ -7,15 +7,69 @@ Usage:
 Requirements:
     - OpenAI Codex CLI installed (https://developers.openai.com/codex/cli/)
     - Either OPENAI_API_KEY environment variable or OAuth authentication
+
+The offline tests in run_offline_tests() need no API key: they run against
+tests/fake_codex.py, and any failure makes the script exit with status 1.
 """
 
+import asyncio
+import contextlib
+import json
 import os
+import re
+import shutil
+import subprocess
 import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
 # Add parent directories to path for imports
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TESTS_DIR)
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+FAKE_CODEX = os.path.join(TESTS_DIR, "fake_codex.py")
+
+from SubjectiveCodexDataSource import (
+    SubjectiveCodexDataSource,
+    CodexResult,
+    _AIMDLimiter,
+    _CodexBinaryCache,
+    _DiskResponseCache,
+    _NDJSONParser,
+    _WorkspaceFingerprinter,
+)
 
-from SubjectiveCodexDataSource import SubjectiveCodexDataSource
+
+@contextlib.contextmanager
+def _fake_env(**variables):
+    """Set FAKE_CODEX_* variables; data sources snapshot the environment when created."""
+    saved = {name: os.environ.get(name) for name in variables}
+    os.environ.update({name: str(value) for name, value in variables.items()})
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _fake_datasource(**params) -> SubjectiveCodexDataSource:
+    """A data source running tests/fake_codex.py with an API key."""
+    return SubjectiveCodexDataSource(
+        name="test_codex_fake",
+        params=dict({
+            "async_mode": False,
+            "auth_method": "api_key",
+            "api_key": "sk-fake",
+            "codex_path": FAKE_CODEX,
+            "coalesce_requests": False
+        }, **params)
+    )
 
 
 def test_installation_check():
@@ -82,6 +136,22 @@ def test_icon():
         print("Warning: Icon not loaded properly")
 
 
+def test_fake_cli():
+    """Test message processing against the fake Codex CLI (no API key needed)."""
+    print("\n" + "=" * 50)
+    print("Testing Fake Codex CLI")
+    print("=" * 50)
+
+    for pool_size in (0, 1):
+        datasource = _fake_datasource(pool_size=pool_size)
+
+        response = datasource._process_message("Hello")
+        datasource.stop()
+        mode = "pooled worker" if pool_size else "codex exec"
+        assert response.get("success") and response.get("response") == "echo: Hello", f"{mode}: {response}"
+        print(f"{mode}: {response.get('response')} (usage: {response.get('usage')})")
+
+
 def test_api_key_auth():
     """Test with API key authentication."""
     print("\n" + "=" * 50)
@@ -197,6 +267,746 @@ def test_async_mode():
     datasource.stop()
 
 
+def test_pool_timeout():
+    """Test that a timed-out pooled request returns within its timeout instead of waiting for the worker."""
+    print("\n" + "=" * 50)
+    print("Testing Worker Pool Timeout")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_STARTUP_DELAY=10):
+        datasource = _fake_datasource(pool_size=1, timeout=1)
+    try:
+        started = time.monotonic()
+        response = datasource._process_message("Too slow")
+        elapsed = time.monotonic() - started
+    finally:
+        datasource.stop()
+
+    assert response.get("error_type") == "timeout", f"slow pooled run: {response}"
+    assert elapsed < 1.8, f"timed-out request took {elapsed:.2f}s with timeout=1"
+    print(f"Timed out after {elapsed:.2f}s")
+
+
+def test_async_fake_cli():
+    """Test aprocess_message, and that cancelling it kills the Codex process."""
+    print("\n" + "=" * 50)
+    print("Testing Async Path")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    pid_file = os.path.join(directory, "pid")
+    try:
+        datasource = _fake_datasource()
+        response = asyncio.run(datasource.aprocess_message("Hello async"))
+        assert response.get("success") and response["response"] == "echo: Hello async", f"async run: {response}"
+
+        with _fake_env(FAKE_CODEX_STARTUP_DELAY=30, FAKE_CODEX_PID_FILE=pid_file):
+            slow_source = _fake_datasource()
+
+        async def cancel_slow_run():
+            task = asyncio.ensure_future(slow_source.aprocess_message("Never finishes"))
+            while not os.path.exists(pid_file):
+                await asyncio.sleep(0.05)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+
+        started = time.monotonic()
+        cancelled = asyncio.run(cancel_slow_run())
+        elapsed = time.monotonic() - started
+        with open(pid_file, encoding="utf-8") as f:
+            pid = int(f.read())
+        try:
+            os.kill(pid, 0)
+            alive = True
+        except ProcessLookupError:
+            alive = False
+        datasource.stop()
+        slow_source.stop()
+
+        assert cancelled, "cancelled task did not raise CancelledError"
+        assert not alive, f"Codex process {pid} survived the cancellation"
+        assert elapsed < 10, f"cancellation took {elapsed:.2f}s"
+        print(f"{response['response']!r}; cancelled run killed process {pid} after {elapsed:.2f}s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_process_batch():
+    """Test that process_batch yields every result once, tagged with its index, as it completes."""
+    print("\n" + "=" * 50)
+    print("Testing Batch Processing")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_SLOW_PROMPT="slow"):
+        datasource = _fake_datasource()
+    messages = ["slow one", "fast one", "fast two", "fast three"]
+    try:
+        results = list(datasource.process_batch(messages, max_concurrency=4))
+    finally:
+        datasource.stop()
+
+    indexes = [index for index, _ in results]
+    assert sorted(indexes) == [0, 1, 2, 3], f"indexes: {indexes}"
+    for index, response in results:
+        assert response.get("response") == f"echo: {messages[index]}", f"result {index}: {response}"
+    assert indexes[-1] == 0, f"the slow message should complete last: {indexes}"
+    print(f"Completion order: {indexes}")
+
+
+def test_response_cache():
+    """Test in-memory cache misses and hits."""
+    print("\n" + "=" * 50)
+    print("Testing Response Cache")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    try:
+        datasource = _fake_datasource(cache_enabled=True, working_directory=directory)
+        first = datasource._process_message("What is cached?")
+        second = datasource._process_message("What is cached?")
+        other = datasource._process_message("Something else")
+        stats = datasource.get_cache_stats()
+        datasource.stop()
+
+        assert first.get("success") and not first.get("cached"), f"first call: {first}"
+        assert second.get("cached") and second["response"] == first["response"], f"second call: {second}"
+        assert not other.get("cached"), f"different prompt: {other}"
+        assert stats["hits"] == 1 and stats["misses"] == 2 and stats["entries"] == 2, f"cache stats: {stats}"
+        print(f"miss -> hit -> miss (stats: {stats})")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_disk_cache():
+    """Test reloading responses from the disk cache, and two instances sharing one file."""
+    print("\n" + "=" * 50)
+    print("Testing Disk Response Cache")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    try:
+        params = {
+            "cache_enabled": True,
+            "disk_cache_path": os.path.join(directory, "cache.db"),
+            "working_directory": directory
+        }
+        datasource = _fake_datasource(**params)
+        first = datasource._process_message("What is cached?")
+        datasource.stop()
+
+        # A new instance reads the disk cache; a different fake reply proves Codex did not run
+        with _fake_env(FAKE_CODEX_RESPONSE="not from the cache"):
+            reloaded_source = _fake_datasource(**params)
+        reloaded = reloaded_source._process_message("What is cached?")
+        stats = reloaded_source.get_cache_stats()
+        reloaded_source.stop()
+        assert reloaded.get("cached") and reloaded["response"] == first["response"], f"reloaded: {reloaded}"
+        assert stats["disk"]["hits"] == 1, f"cache stats: {stats}"
+
+        # Two open caches on one file share the size cap and see each other's keys
+        shared_path = os.path.join(directory, "shared.db")
+        left = _DiskResponseCache(shared_path, max_bytes=20000, ttl=0)
+        right = _DiskResponseCache(shared_path, max_bytes=20000, ttl=0)
+        for index in range(40):
+            (left if index % 2 else right).put(f"key-{index}", {"response": os.urandom(500).hex()})
+        right.put("written-later", {"response": "shared"})
+        seen = left.get("written-later")
+        left_bytes, right_bytes = left.stats()["bytes"], right.stats()["bytes"]
+        left.close()
+        right.close()
+        assert left_bytes == right_bytes <= 20000, f"shared cap: {left_bytes} / {right_bytes} bytes"
+        assert seen == {"response": "shared"}, f"key written by the other instance: {seen}"
+        print(f"Reloaded {reloaded['response']!r} from disk; shared file holds {left_bytes} bytes")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_workspace_fingerprint():
+    """Test git fingerprints from a subdirectory, and that they leave the index alone."""
+    print("\n" + "=" * 50)
+    print("Testing Workspace Fingerprint")
+    print("=" * 50)
+
+    if not shutil.which("git"):
+        print("git not installed, skipping workspace fingerprint test")
+        return
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    try:
+        def git(*args):
+            subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.invalid", *args],
+                           cwd=directory, check=True, capture_output=True)
+
+        def write(name, text, age):
+            path = os.path.join(directory, name)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+            # Old mtimes, so only the stat signature (not the racy-edit window) can notice the change
+            stamp = time.time() - age
+            os.utime(path, (stamp, stamp))
+
+        os.makedirs(os.path.join(directory, "sub"))
+        write("tracked.txt", "one\n", 100)
+        write(os.path.join("sub", "inner.txt"), "inner\n", 100)
+        git("init", "-q")
+        git("add", ".")
+        git("commit", "-q", "-m", "initial")
+        write("tracked.txt", "two\n", 90)
+        write("untracked.txt", "aaaa\n", 90)
+
+        with open(os.path.join(directory, ".git", "index"), "rb") as f:
+            index_before = f.read()
+        fingerprinter = _WorkspaceFingerprinter()
+        subdirectory = os.path.join(directory, "sub")
+        first = fingerprinter.fingerprint(subdirectory, ttl=0, max_files=1000)
+
+        # Same sizes, new content and mtimes, in the repository root
+        write("tracked.txt", "six\n", 80)
+        second = fingerprinter.fingerprint(subdirectory, ttl=0, max_files=1000)
+        write("untracked.txt", "bbbb\n", 70)
+        third = fingerprinter.fingerprint(subdirectory, ttl=0, max_files=1000)
+        with open(os.path.join(directory, ".git", "index"), "rb") as f:
+            index_after = f.read()
+
+        assert first and len({first, second, third}) == 3, f"fingerprints: {first}, {second}, {third}"
+        assert index_after == index_before, "fingerprinting rewrote the git index"
+        assert not os.path.exists(os.path.join(directory, ".git", "index.lock"))
+        print("Subdirectory fingerprints follow edits anywhere in the repository; index untouched")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_coalescing():
+    """Test that identical prompts in flight at once share a single Codex run."""
+    print("\n" + "=" * 50)
+    print("Testing Request Coalescing")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_STARTUP_DELAY=0.5):
+        datasource = _fake_datasource(coalesce_requests=True)
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(datasource._process_message, ["Same prompt"] * 4))
+        different = datasource._process_message("Another prompt")
+    finally:
+        datasource.stop()
+
+    assert all(response.get("response") == "echo: Same prompt" for response in responses), responses
+    shared = sum(1 for response in responses if response.get("coalesced"))
+    assert shared == 3, f"expected 3 of 4 identical prompts to share one run, got {shared}"
+    assert not different.get("coalesced"), f"unrelated prompt: {different}"
+    print(f"4 identical prompts -> 1 run ({shared} coalesced)")
+
+
+def test_scheduler():
+    """Test deadline expiry and priority order in schedule_message."""
+    print("\n" + "=" * 50)
+    print("Testing Scheduler")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_STARTUP_DELAY=0.3):
+        datasource = _fake_datasource(scheduler_workers=1)
+    try:
+        expired = datasource.schedule_message("Too late", deadline=time.time() - 1).result(timeout=5)
+        assert expired.get("error_type") == "deadline_exceeded", f"past deadline: {expired}"
+
+        order = []
+        # Occupies the only worker while the rest queue up
+        blocker = datasource.schedule_message("blocker")
+        time.sleep(0.1)
+        futures = [
+            datasource.schedule_message(prompt, priority=priority, callback=lambda r: order.append(r["original_message"]))
+            for prompt, priority in (("batch", "batch"), ("default", "default"), ("interactive", "interactive"))
+        ]
+        queued_expiry = datasource.schedule_message("expires in queue", priority="interactive",
+                                                    deadline=time.time() + 0.1)
+
+        assert blocker.result(timeout=10).get("success")
+        assert queued_expiry.result(timeout=10).get("error_type") == "deadline_exceeded"
+        for future in futures:
+            assert future.result(timeout=10).get("success")
+        assert order == ["interactive", "default", "batch"], f"completion order: {order}"
+        print(f"Expired requests rejected; ran in priority order {order}")
+    finally:
+        datasource.stop()
+
+
+def test_stdin_prompts():
+    """Test prompts streamed over stdin from a file path, an iterable and a file object."""
+    print("\n" + "=" * 50)
+    print("Testing Stdin Prompts")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    # Several read chunks long, with multi-byte characters across chunk edges
+    prompt = "Summarize: " + "é" * 50000 + "x" * 100000
+    path = os.path.join(directory, "prompt.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(prompt)
+    try:
+        datasource = _fake_datasource()
+        from_path = datasource._process_message({"content_path": path})
+        from_chunks = datasource._process_message({"content_stream": [prompt[:70000], prompt[70000:]]})
+        with open(path, "rb") as f:
+            from_file = datasource._process_message(f)
+        with open(path, encoding="utf-8") as f:
+            from_async = asyncio.run(datasource.aprocess_message({"content_stream": f}))
+        datasource.stop()
+
+        for label, response in (("content_path", from_path), ("content_stream", from_chunks),
+                                ("file object", from_file), ("async content_stream", from_async)):
+            assert response.get("success"), f"{label}: {response}"
+            assert response["response"] == f"echo: {prompt}", f"{label}: prompt arrived altered"
+        assert from_path["original_message"] == path, from_path["original_message"]
+        print(f"{len(prompt.encode('utf-8'))}-byte prompt delivered intact four ways")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_parser_chunk_boundary():
+    """Test an NDJSON line split across two reads."""
+    print("\n" + "=" * 50)
+    print("Testing Parser Chunk Boundary")
+    print("=" * 50)
+
+    stream = (json.dumps({"type": "agent_message_delta", "delta": "héllo"}, ensure_ascii=False) + "\n"
+              + json.dumps({"type": "message", "role": "assistant"}) + "\n").encode("utf-8")
+    # Split inside the multi-byte "é" as well as inside the second line
+    split = stream.index("é".encode("utf-8")) + 1
+    for chunks in ([stream[:split], stream[split:]], [stream[:-10], stream[-10:]], [stream[:5], stream[5:]]):
+        parser = _NDJSONParser()
+        events = []
+        for chunk in chunks:
+            events.extend(event for event, _ in parser.feed(chunk))
+        events.extend(event for event, _ in parser.close())
+        assert [event["type"] for event in events] == ["agent_message_delta", "message"], events
+        assert events[0]["delta"] == "héllo", events
+        assert parser.bytes_parsed == len(stream), parser.bytes_parsed
+    print("Lines split across chunks decode to the same events")
+
+
+def test_event_retention():
+    """Test the event retention presets and a per-type policy."""
+    print("\n" + "=" * 50)
+    print("Testing Event Retention")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_EVENT_BYTES=300):
+        sources = {
+            name: _fake_datasource(event_retention=policy)
+            for name, policy in (("all", "all"), ("summary", "summary"), ("none", "none"),
+                                 ("custom", {"drop": ["exec_command_end"]}))
+        }
+    responses = {}
+    for name, datasource in sources.items():
+        responses[name] = datasource._process_message("Retain")
+        datasource.stop()
+
+    for name, response in responses.items():
+        # Dropping events never loses the reply or the token usage read from them
+        assert response.get("response") == "echo: Retain", f"{name}: {response}"
+        assert response["usage"]["input_tokens"] == len("Retain"), f"{name}: {response['usage']}"
+
+    kept = list(responses["all"]["events"])
+    assert [event["type"] for event in kept].count("exec_command_end") == 3, kept
+    assert len(kept[0]["stdout"]) == 300, "the 'all' preset must keep events unchanged"
+
+    summarized = list(responses["summary"]["events"])
+    assert len(summarized) == len(kept) and all(event.get("summarized") for event in summarized), summarized
+    assert "stdout" not in summarized[0] and summarized[0]["exit_code"] == 0, summarized[0]
+
+    assert len(responses["none"]["events"]) == 0, list(responses["none"]["events"])
+
+    custom_types = [event["type"] for event in responses["custom"]["events"]]
+    assert "exec_command_end" not in custom_types and "message" in custom_types, custom_types
+    print(f"all: {len(kept)} events, summary: {len(summarized)} summarized, none: 0, custom: {custom_types}")
+
+
+def test_lazy_results():
+    """Test that CodexResult reads like the response dict through get() and []."""
+    print("\n" + "=" * 50)
+    print("Testing Lazy Results")
+    print("=" * 50)
+
+    eager_source = _fake_datasource()
+    lazy_source = _fake_datasource(lazy_results=True)
+    eager = eager_source._process_message("Lazy")
+    lazy = lazy_source._process_message("Lazy")
+    eager_source.stop()
+    lazy_source.stop()
+
+    assert isinstance(lazy, CodexResult) and isinstance(eager, dict), (type(lazy), type(eager))
+    assert lazy["response"] == lazy.get("response") == eager["response"], lazy
+    assert lazy.get("usage") == eager["usage"], lazy.get("usage")
+    assert lazy.get("missing") is None and lazy.get("missing", "default") == "default"
+    try:
+        lazy["missing"]
+        raise AssertionError("missing key did not raise KeyError")
+    except KeyError:
+        pass
+
+    events = lazy["events"]
+    assert "events" in lazy and len(events) == len(eager["events"]), events
+    assert events[0] == eager["events"][0] and events[-1] == eager["events"][-1], (events[0], events[-1])
+    assert events[1:3] == eager["events"][1:3]
+    plain = lazy.to_dict()
+    assert plain["events"] == eager["events"] and plain["response"] == eager["response"], plain
+    tagged = lazy.with_fields(cached=True)
+    assert tagged.get("cached") and not lazy.get("cached") and len(tagged["events"]) == len(events)
+    print(f"CodexResult with {len(events)} lazy events matches the dict result")
+
+
+def test_spill():
+    """Test spilling events above spill_threshold_bytes, including a spill that retains nothing."""
+    print("\n" + "=" * 50)
+    print("Testing Output Spill")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_EVENTS=50, FAKE_CODEX_EVENT_BYTES=1000):
+        spilled_source = _fake_datasource(spill_threshold_bytes=1000)
+        lazy_source = _fake_datasource(spill_threshold_bytes=1000, lazy_results=True)
+        empty_source = _fake_datasource(spill_threshold_bytes=1000, event_retention="none")
+        unspilled_source = _fake_datasource()
+    spilled = spilled_source._process_message("Spill")
+    lazy = lazy_source._process_message("Spill")
+    empty = empty_source._process_message("Spill")
+    unspilled = unspilled_source._process_message("Spill")
+    for datasource in (spilled_source, lazy_source, empty_source, unspilled_source):
+        datasource.stop()
+
+    assert spilled.get("success") and spilled.get("spilled"), f"spilled run: {spilled}"
+    # Without lazy_results the result stays a plain dict; only its events live in the spill file
+    assert type(spilled) is dict, type(spilled)
+    assert list(spilled["events"]) == unspilled["events"], "spilled events differ from in-memory ones"
+    assert len(bytes(spilled["raw_output"])) > 50 * 1000, len(spilled["raw_output"])
+
+    assert isinstance(lazy, CodexResult) and lazy.get("spilled"), f"lazy spilled run: {lazy}"
+    assert lazy["events"][3] == unspilled["events"][3]
+
+    assert empty.get("success") and empty["response"] == "echo: Spill", f"empty spill: {empty}"
+    assert len(empty["events"]) == 0, list(empty["events"])
+    print(f"Spilled {len(spilled['events'])} events ({len(spilled['raw_output'])} bytes); empty spill succeeded")
+
+
+def test_metrics():
+    """Test the Prometheus text from get_metrics() and the metrics_port exporter."""
+    print("\n" + "=" * 50)
+    print("Testing Metrics")
+    print("=" * 50)
+
+    # Metrics are process-wide; a model name of its own keeps other tests' samples apart
+    datasource = _fake_datasource(model="metrics-test", metrics_port=0)
+    try:
+        datasource._process_message("Count me")
+        datasource._process_message("Count me too")
+        text = datasource.get_metrics()
+        with urllib.request.urlopen(f"http://127.0.0.1:{datasource.metrics_port}/metrics", timeout=5) as reply:
+            served = reply.read().decode("utf-8")
+    finally:
+        datasource.stop()
+
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = re.fullmatch(r"([a-z_]+)(\{[^}]*\})? (\S+)", line)
+        assert match, f"not a Prometheus sample line: {line!r}"
+        samples[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+
+    assert samples['codex_requests_total{model="metrics-test",outcome="success"}'] == 2, samples
+    assert samples['codex_phase_seconds_count{model="metrics-test",phase="total"}'] == 2, samples
+    assert samples['codex_phase_seconds_bucket{model="metrics-test",phase="total",le="+Inf"}'] == 2, samples
+    assert samples['codex_tokens_total{kind="input_tokens",model="metrics-test"}'] > 0, samples
+    assert "# TYPE codex_phase_seconds histogram" in text
+    assert 'codex_requests_total{model="metrics-test",outcome="success"} 2' in served, "exporter body differs"
+    print(f"{len(samples)} samples, served on port {datasource.metrics_port}")
+
+
+def test_usage_accounting():
+    """Test per-response usage and get_usage_stats() totals and cost."""
+    print("\n" + "=" * 50)
+    print("Testing Usage Accounting")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    try:
+        datasource = _fake_datasource(
+            model="usage-test",
+            token_prices={"usage-test": {"input": 2.0, "output": 10.0}},
+            cache_enabled=True,
+            working_directory=directory
+        )
+        first = datasource._process_message("abcd")
+        second = datasource._process_message("efghij")
+        cached = datasource._process_message("abcd")
+        stats = datasource.get_usage_stats()
+        datasource.stop()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # The fake CLI reports the prompt and reply lengths as token counts
+    assert first["usage"]["input_tokens"] == 4 and first["usage"]["output_tokens"] == len("echo: abcd"), first
+    assert second["usage"]["input_tokens"] == 6, second["usage"]
+    assert cached.get("cached"), cached
+
+    # Cache hits spend no tokens and are not counted
+    assert stats["requests"] == 2, stats
+    assert stats["total"]["input_tokens"] == 10, stats["total"]
+    output_tokens = len("echo: abcd") + len("echo: efghij")
+    assert stats["total"]["output_tokens"] == output_tokens, stats["total"]
+    expected_cost = (10 * 2.0 + output_tokens * 10.0) / 1_000_000
+    assert abs(stats["by_model"]["usage-test"]["cost"] - expected_cost) < 1e-12, stats["by_model"]
+    assert stats["window"]["requests"] == 2, stats["window"]
+    print(f"2 runs, {stats['total']['input_tokens']} input / {output_tokens} output tokens, "
+          f"cost {stats['by_model']['usage-test']['cost']:.6f}")
+
+
+def test_record_replay():
+    """Test recording runs to a cassette and replaying them without Codex."""
+    print("\n" + "=" * 50)
+    print("Testing Record and Replay")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    cassette = os.path.join(directory, "runs.jsonl")
+    try:
+        recorder = _fake_datasource(record_path=cassette)
+        recorded = recorder._process_message("Record me")
+        recorder.stop()
+        assert recorded.get("success"), f"recorded run: {recorded}"
+
+        # No Codex binary at all: the answer can only come from the cassette
+        replayer = _fake_datasource(replay_path=cassette, replay_speed=0, codex_path=os.path.join(directory, "missing"))
+        replayed = replayer._process_message("Record me")
+        replayer.stop()
+
+        assert replayed.get("success"), f"replayed run: {replayed}"
+        assert replayed["response"] == recorded["response"], f"{replayed['response']!r} != {recorded['response']!r}"
+        assert replayed["usage"] == recorded["usage"], f"{replayed['usage']} != {recorded['usage']}"
+        print(f"Replayed {replayed['response']!r} from {cassette}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_binary_probe_cache():
+    """Test that codex --version is probed once per binary and again only after it changes."""
+    print("\n" + "=" * 50)
+    print("Testing Binary Probe Cache")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    binary = os.path.join(directory, "codex")
+    probes = os.path.join(directory, "probes")
+
+    def install(version):
+        with open(binary, "w", encoding="utf-8") as f:
+            f.write(f"#!/bin/sh\necho probe >> '{probes}'\necho 'codex-cli {version}'\n")
+        os.chmod(binary, 0o755)
+
+    def probe_count():
+        if not os.path.exists(probes):
+            return 0
+        with open(probes, encoding="utf-8") as f:
+            return len(f.readlines())
+
+    try:
+        install("1.0.0")
+        persist_path = os.path.join(directory, "binaries.json")
+        cache = _CodexBinaryCache()
+        cache.configure(persist_path)
+        first = cache.version(binary)
+        second = cache.version(binary)
+        assert first == second == {"version": "codex-cli 1.0.0"}, (first, second)
+        assert probe_count() == 1, f"probed {probe_count()} times for an unchanged binary"
+
+        # A new process reads the persisted probe instead of running the binary
+        restarted = _CodexBinaryCache()
+        restarted.configure(persist_path)
+        assert restarted.version(binary) == first and probe_count() == 1, probe_count()
+
+        install("1.10.0")
+        upgraded = cache.version(binary)
+        assert upgraded == {"version": "codex-cli 1.10.0"} and probe_count() == 2, (upgraded, probe_count())
+
+        datasource = _fake_datasource()
+        status = datasource.check_codex_installation()
+        datasource.stop()
+        assert status.get("installed") and status.get("version") == "codex-cli 0.0.0-fake", status
+        print(f"{probe_count()} probes for 5 lookups; fake CLI reports {status['version']}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_relogin_after_expiry():
+    """Test that an expired OAuth session starts a new login instead of staying authenticated."""
+    print("\n" + "=" * 50)
+    print("Testing Re-login After Session Expiry")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    login_file = os.path.join(directory, "session")
+    try:
+        with _fake_env(FAKE_CODEX_LOGIN_FILE=login_file):
+            datasource = _fake_datasource(
+                auth_method="oauth",
+                api_key="",
+                codex_home=directory,
+                auth_wait="queue",
+                auth_on_start=False,
+                auth_check_ttl=0.5
+            )
+        first = datasource._process_message("Before expiry")
+        assert first.get("success") and os.path.exists(login_file), f"first login: {first}"
+
+        # The session expires behind our back; once the check TTL passes it must log in again
+        os.remove(login_file)
+        time.sleep(0.6)
+        second = datasource._process_message("After expiry")
+        assert second.get("success") and os.path.exists(login_file), f"after expiry: {second}"
+
+        # A session the service rejects is invalidated and also logs in again
+        os.remove(login_file)
+        rejected = datasource._process_message("Rejected")
+        assert rejected.get("error"), f"rejected run: {rejected}"
+        assert datasource.get_auth_status()["state"] != "authenticated", datasource.get_auth_status()
+        third = datasource._process_message("After rejection")
+        status = datasource.get_auth_status()
+        datasource.stop()
+        assert third.get("success") and status["state"] == "authenticated" and status["valid"], status
+        print(f"Logged in again after expiry and after rejection (state: {status['state']})")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_environment_isolation():
+    """Test that instances with different keys and CODEX_HOMEs never touch os.environ."""
+    print("\n" + "=" * 50)
+    print("Testing Environment Isolation")
+    print("=" * 50)
+
+    directory = tempfile.mkdtemp(prefix="codex-test-")
+    before = dict(os.environ)
+    try:
+        datasources = [
+            _fake_datasource(api_key=f"sk-fake-{index}", codex_home=os.path.join(directory, f"home-{index}"))
+            for index in range(2)
+        ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(
+                lambda job: job[0]._process_message(f"env {job[1]}"),
+                [(datasources[index % 2], index) for index in range(8)]
+            ))
+        for datasource in datasources:
+            datasource.stop()
+
+        assert all(response.get("success") for response in responses), responses
+        assert dict(os.environ) == before, "os.environ was modified"
+        for index, datasource in enumerate(datasources):
+            env = datasource._build_env()
+            assert env["OPENAI_API_KEY"] == f"sk-fake-{index}", env.get("OPENAI_API_KEY")
+            assert env["CODEX_HOME"] == os.path.join(directory, f"home-{index}"), env.get("CODEX_HOME")
+            try:
+                env["OPENAI_API_KEY"] = "sk-other"
+            except TypeError:
+                pass
+            else:
+                raise AssertionError("child environment snapshot is writable")
+        print(f"{len(responses)} concurrent requests across 2 instances left os.environ unchanged")
+    finally:
+        os.environ.clear()
+        os.environ.update(before)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def test_api_key_cooldown():
+    """Test that a key rejected with a 429 cools down and traffic moves to the other key."""
+    print("\n" + "=" * 50)
+    print("Testing API Key Cooldown")
+    print("=" * 50)
+
+    with _fake_env(FAKE_CODEX_RATE_LIMIT_KEY="sk-limited"):
+        datasource = _fake_datasource(api_key="sk-good", api_keys=["sk-limited"], api_key_cooldown=60)
+    try:
+        results = [datasource._process_message(f"Request {index}") for index in range(4)]
+        stats = {entry["key_id"]: entry for entry in datasource.get_api_key_stats()}
+    finally:
+        datasource.stop()
+
+    limited = [result for result in results if not result.get("success")]
+    assert len(limited) == 1, f"expected exactly one rate-limited run: {results}"
+    limited_key = limited[0]["api_key_id"]
+    assert stats[limited_key]["rate_limited"] == 1 and stats[limited_key]["cooldown_remaining"] > 0, stats
+    after = results[results.index(limited[0]) + 1:]
+    assert after and all(result.get("success") and result["api_key_id"] != limited_key for result in after), results
+    print(f"Key {limited_key} cooling down for {stats[limited_key]['cooldown_remaining']:.0f}s")
+
+
+def test_aimd_limiter():
+    """Test the adaptive concurrency limit: cut on overload, regrow on success."""
+    print("\n" + "=" * 50)
+    print("Testing AIMD Concurrency Limiter")
+    print("=" * 50)
+
+    limiter = _AIMDLimiter(initial=8, minimum=1, maximum=16, decrease=0.5)
+    burst = [limiter.acquire() for _ in range(8)]
+    assert not limiter.try_acquire(), "limit of 8 should be full"
+
+    # A burst of failures from runs started before the cut counts once
+    for started_at in burst[:4]:
+        limiter.release(started_at, "overload")
+    assert limiter.limit == 4, f"limit after overload burst: {limiter.limit}"
+    for started_at in burst[4:]:
+        limiter.release(started_at, None)
+
+    for _ in range(40):
+        limiter.release(limiter.acquire(), "success")
+    assert 8 < limiter.limit <= 16, f"limit after regrowth: {limiter.limit}"
+
+    regrown = limiter.limit
+    limiter.release(limiter.acquire(), "overload")
+    assert limiter.limit == regrown / 2, f"second cut: {limiter.limit}"
+    print(f"8 -> 4 on overload, regrew to {regrown:.2f}, cut again to {limiter.limit:.2f}")
+
+
+def run_offline_tests() -> list:
+    """Run the tests that need neither the real CLI nor an API key; return the names that failed."""
+    failures = []
+    for test in (
+        test_fake_cli,
+        test_pool_timeout,
+        test_async_fake_cli,
+        test_process_batch,
+        test_response_cache,
+        test_disk_cache,
+        test_workspace_fingerprint,
+        test_coalescing,
+        test_scheduler,
+        test_stdin_prompts,
+        test_parser_chunk_boundary,
+        test_event_retention,
+        test_lazy_results,
+        test_spill,
+        test_metrics,
+        test_usage_accounting,
+        test_record_replay,
+        test_binary_probe_cache,
+        test_relogin_after_expiry,
+        test_environment_isolation,
+        test_api_key_cooldown,
+        test_aimd_limiter,
+    ):
+        try:
+            test()
+        except Exception as e:
+            print(f"FAILED {test.__name__}: {e!r}")
+            failures.append(test.__name__)
+    return failures
+
+
 def main():
     """Run all tests."""
     print("SubjectiveCodexDataSource Test Suite")
@@ -206,20 +1016,25 @@ def main():
     installed = test_installation_check()
     test_connection_data()
     test_icon()
+    failures = run_offline_tests()
 
     if not installed:
         print("\nSkipping functional tests - Codex CLI not installed")
-        return
-
-    # Functional tests (require API key)
-    test_api_key_auth()
-    test_sync_mode()
-    test_async_mode()
+    else:
+        # Functional tests (require API key)
+        test_api_key_auth()
+        test_sync_mode()
+        test_async_mode()
 
     print("\n" + "=" * 50)
+    if failures:
+        print(f"{len(failures)} test(s) failed: {', '.join(failures)}")
+        print("=" * 50)
+        return 1
     print("All tests completed!")
     print("=" * 50)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())